@@ -1,5 +1,55 @@
+from typing import Any, List, Optional, Tuple
+
 from meilisearch_python_sdk import AsyncClient
 
+from meilisync.progress import Progress
+from meilisync.settings import Sync
+from meilisync.source import Source
+
 client = AsyncClient(
     "http://localhost:7700",
 )
+
+
+class MemoryProgress(Progress):
+    def __init__(self):
+        super().__init__()
+        self.writes: List[dict] = []
+        self.snapshots: dict = {}
+
+    async def set(self, **kwargs):
+        self.writes.append(kwargs)
+
+    async def get_snapshot(self, name: str):
+        return self.snapshots.get(name)
+
+    async def set_snapshot(self, name: str, state: Optional[dict]):
+        if state is None:
+            self.snapshots.pop(name, None)
+        else:
+            self.snapshots[name] = state
+
+
+class MemorySource(Source):
+    def __init__(self, rows: List[dict], ranges: Optional[List[Tuple[Any, Any]]] = None):
+        super().__init__({}, ["test"])
+        self.rows = rows
+        self.ranges = ranges
+
+    async def get_ranges(self, sync: Sync):
+        return self.ranges or await super().get_ranges(sync)
+
+    async def get_full_data(self, sync: Sync, size: int, start=None, end=None):
+        rows = [
+            row
+            for row in self.rows
+            if (start is None or row["id"] > start) and (end is None or row["id"] <= end)
+        ]
+        for i in range(0, len(rows), size):
+            yield rows[i : i + size]
+
+    async def get_count(self, sync: Sync):
+        return len(self.rows)
+
+    async def get_existing_keys(self, sync: Sync, keys: List[Any]):
+        return {str(row["id"]) for row in self.rows if row["id"] in keys}
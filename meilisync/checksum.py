@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, List, Optional
+
+from meilisync.meili import Meili
+from meilisync.settings import Sync
+from meilisync.source import Source
+
+
+def digest(docs: List[Optional[dict]]):
+    h = hashlib.blake2b(digest_size=16)
+    for doc in docs:
+        h.update(json.dumps(doc, sort_keys=True, default=str).encode())
+    return h.digest()
+
+
+@dataclass(slots=True)
+class ChecksumResult:
+    checked: int = 0
+    chunks: int = 0
+    mismatched_chunks: int = 0
+    different: int = 0
+    missing: int = 0
+    extra: int = 0
+    repaired: int = 0
+
+
+class Checksum:
+    """
+    Compare the documents of a table with its index chunk by chunk, a chunk whose hash differs is
+    compared document by document, and only the differing documents are sent again on repair.
+    """
+
+    def __init__(self, source: Source, meili: Meili, sync: Sync, size: int = 1000):
+        self.source = source
+        self.meili = meili
+        self.sync = sync
+        self.size = size
+        self.index = meili.client.index(sync.index_name)
+        self.result = ChecksumResult()
+
+    async def _check_chunk(self, rows: List[dict], repair: bool):
+        pk = self.sync.pk
+        docs = self.sync.transform(rows)
+        ids = [str(doc[pk]) for doc in docs]
+        fields = list({key for doc in docs for key in doc})
+        ret = await self.index.get_documents(ids=ids, fields=fields, limit=len(ids))
+        meili_docs = {str(doc[pk]): doc for doc in ret.results}
+        result = self.result
+        result.checked += len(docs)
+        result.chunks += 1
+        if digest(docs) == digest([meili_docs.get(id_) for id_ in ids]):
+            return
+        result.mismatched_chunks += 1
+        stale = []
+        for row, doc, id_ in zip(rows, docs, ids):
+            meili_doc = meili_docs.get(id_)
+            if meili_doc is None:
+                result.missing += 1
+            elif digest([doc]) != digest([meili_doc]):
+                result.different += 1
+            else:
+                continue
+            stale.append(row)
+        if repair and stale:
+            await self.meili.add_data(self.sync, stale)
+            result.repaired += len(stale)
+
+    async def _check_range(self, data: AsyncGenerator, repair: bool):
+        async for rows in data:
+            await self._check_chunk(rows, repair)
+
+    async def _find_extra(self) -> List[Any]:
+        # documents that are no longer in the database, looked up page by page
+        extra: List[Any] = []
+        offset = 0
+        while True:
+            ret = await self.index.get_documents(
+                offset=offset, limit=self.size, fields=[self.sync.pk]
+            )
+            keys = [doc[self.sync.pk] for doc in ret.results]
+            if not keys:
+                return extra
+            existing = await self.source.get_existing_keys(
+                self.sync, [self.source.load_key(key) for key in keys]
+            )
+            extra.extend(key for key in keys if str(key) not in existing)
+            offset += len(keys)
+
+    async def run(self, repair: bool = False):
+        await asyncio.gather(
+            *[
+                self._check_range(
+                    self.source.get_full_data(self.sync, self.size, start, end), repair
+                )
+                for start, end in await self.source.get_ranges(self.sync)
+            ]
+        )
+        count, meili_count = await asyncio.gather(
+            self.source.get_count(self.sync), self.meili.get_count(self.sync.index_name)
+        )
+        if meili_count > count - self.result.missing:
+            extra = await self._find_extra()
+            self.result.extra = len(extra)
+            if repair and extra:
+                await self.index.delete_documents([str(key) for key in extra])
+                self.result.repaired += len(extra)
+        return self.result
@@ -16,3 +16,14 @@ class SourceType(str, Enum):
 class ProgressType(str, Enum):
     file = "file"
     redis = "redis"
+
+
+class PaginationType(str, Enum):
+    keyset = "keyset"
+    offset = "offset"
+    stream = "stream"
+
+
+class CompressionType(str, Enum):
+    gzip = "gzip"
+    deflate = "deflate"
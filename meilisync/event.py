@@ -1,36 +1,77 @@
+from typing import Dict
+
 from meilisync.enums import EventType
-from meilisync.schemas import Event
+from meilisync.schemas import Event, EventBatch
 from meilisync.settings import Sync
 
 
 class EventCollection:
+    """
+    Pending changes per sync, the row data is kept per event type and primary key, so a batch
+    is merged row by row without wrapping each row in an `Event`.
+    """
+
     def __init__(self):
         self._events = {}
+        self._size = 0
+
+    def _buckets(self, sync: Sync):
+        buckets = self._events.get(sync)
+        if buckets is None:
+            buckets = self._events[sync] = {
+                EventType.create: {},
+                EventType.update: {},
+                EventType.delete: {},
+            }
+        return buckets
+
+    def _add(self, buckets: Dict[EventType, dict], pk, event_type: EventType, data: dict):
+        created, updated, deleted = buckets.values()
+        if pk in created:
+            if event_type == EventType.delete:
+                # the create may replace a document that is already in MeiliSearch, so the
+                # delete is still sent, deleting a missing document is harmless
+                del created[pk]
+                deleted[pk] = data
+            elif event_type == EventType.update:
+                created[pk] = {**created[pk], **data}
+            else:
+                created[pk] = data
+            return
+        if pk in updated:
+            if event_type == EventType.update:
+                updated[pk] = {**updated[pk], **data}
+                return
+            del updated[pk]
+        elif pk in deleted:
+            del deleted[pk]
+        else:
+            self._size += 1
+        buckets[event_type][pk] = data
 
     def add_event(self, sync: Sync, event: Event):
-        pk = event.data[sync.pk]
-        self._events.setdefault(sync, {})
-        self._events[sync][pk] = event
+        self._add(self._buckets(sync), event.data[sync.pk], event.type, event.data)
+
+    def add_events(self, sync: Sync, batch: EventBatch):
+        buckets = self._buckets(sync)
+        pk = sync.pk
+        event_type = batch.type
+        for data in batch.data:
+            self._add(buckets, data[pk], event_type, data)
 
     @property
     def size(self):
-        return sum([len(events) for events in self._events.values()])
+        return self._size
 
     @property
     def pop_events(self):
-        updated_events = {}
         created_events = {}
+        updated_events = {}
         deleted_events = {}
-        for sync, events in self._events.items():
-            updated_events[sync] = []
-            created_events[sync] = []
-            deleted_events[sync] = []
-            for event in events.values():
-                if event.type == EventType.create:
-                    created_events[sync].append(event)
-                elif event.type == EventType.update:
-                    updated_events[sync].append(event)
-                elif event.type == EventType.delete:
-                    deleted_events[sync].append(event)
+        for sync, buckets in self._events.items():
+            created_events[sync] = list(buckets[EventType.create].values())
+            updated_events[sync] = list(buckets[EventType.update].values())
+            deleted_events[sync] = list(buckets[EventType.delete].values())
         self._events = {}
+        self._size = 0
         return created_events, updated_events, deleted_events
@@ -1,20 +1,45 @@
 import asyncio
-from typing import List, Optional
+import time
+from typing import Awaitable, Callable, List, Optional
 
 import typer
 import yaml
 from loguru import logger
 
+from meilisync.checksum import Checksum
 from meilisync.discover import get_progress, get_source
 from meilisync.event import EventCollection
-from meilisync.meili import Meili
-from meilisync.schemas import Event
-from meilisync.settings import Settings
+from meilisync.meili import InsertSizeController, Meili, TaskTracker
+from meilisync.progress import Checkpointer
+from meilisync.schemas import Event, EventBatch
+from meilisync.settings import Settings, Sync
+from meilisync.snapshot import Snapshot
+from meilisync.spool import Spool
 from meilisync.version import __VERSION__
 
 app = typer.Typer()
 
 
+async def gather_syncs(syncs: List[Sync], concurrency: int, func: Callable[[Sync], Awaitable]):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _(sync: Sync):
+        async with semaphore:
+            return await func(sync)
+
+    return await asyncio.gather(*[_(sync) for sync in syncs])
+
+
+def log_full_data(settings: Settings, sync: Sync, count: int):
+    if count:
+        logger.info(
+            f'Full data sync for table "{settings.source.database}.{sync.table}" '
+            f"done! {count} documents added."
+        )
+    else:
+        logger.info(f'No data found for table "{settings.source.database}.{sync.table}".')
+
+
 @app.callback()
 def callback(
     context: typer.Context,
@@ -44,16 +69,27 @@ def callback(
                 environment=sentry.environment,
             )
         progress = get_progress(settings.progress.type)(
-            **settings.progress.model_dump(exclude={"type"})
+            **settings.progress.model_dump(
+                exclude={"type", "checkpoint_interval", "checkpoint_size"}
+            )
         )
         current_progress = await progress.get()
         source = get_source(settings.source.type)(
             progress=current_progress,
             tables=settings.tables,
+            columns=settings.columns,
             **settings.source.model_dump(exclude={"type"}),
         )
         meilisearch = settings.meilisearch
-        meili = Meili(meilisearch.api_url, meilisearch.api_key, settings.plugins_cls())
+        meili = Meili(
+            meilisearch.api_url,
+            meilisearch.api_key,
+            settings.plugins_cls(),
+            max_tasks=meilisearch.max_tasks,
+            flush_concurrency=meilisearch.flush_concurrency,
+            ndjson=meilisearch.ndjson,
+            compression=meilisearch.compression,
+        )
         context.obj["current_progress"] = current_progress
         context.obj["source"] = source
         context.obj["meili"] = meili
@@ -80,62 +116,166 @@ def start(
     meili_settings = settings.meilisearch
     collection = EventCollection()
     lock = None
+    flush_task = None
+
+    checkpointer = Checkpointer(
+        progress,
+        interval=settings.progress.checkpoint_interval,
+        size=settings.progress.checkpoint_size,
+    )
+
+    async def set_progress(value: dict):
+        await checkpointer.set(**value)
+
+    controller = None
+    if meili_settings.adaptive:
+        controller = InsertSizeController(meili_settings.adaptive)
+    tracker = TaskTracker(
+        meili.client, set_progress, on_finished=controller.observe_tasks if controller else None
+    )
+
+    def insert_size():
+        return controller.insert_size if controller else meili_settings.insert_size
+
+    def track(tasks: list, value: Optional[dict]):
+        # the progress is stored once MeiliSearch has processed all the tasks before it
+        if value:
+            tracker.add(tasks, dict(value))
+
+    async def flush_events(events: tuple, flush_progress: Optional[dict]):
+        try:
+            tasks = await meili.flush_events(*events)
+        except Exception as e:
+            # the progress can't move past changes that were never sent
+            tracker.fail(e)
+            raise
+        track(tasks, flush_progress)
+
+    async def flush():
+        nonlocal flush_task
+        if flush_task:
+            try:
+                await flush_task
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f"Error when insert data to MeiliSearch: {e}")
+            flush_task = None
+        if tracker.error:
+            # the progress can't move past a failed batch or task, it is synced again from there
+            raise tracker.error
+        # swap the buffer, the next batch is collected while this one is inserted
+        events = collection.pop_events
+        flush_progress = dict(current_progress) if current_progress else None
+        flush_task = asyncio.ensure_future(flush_events(events, flush_progress))
+
+    def idle():
+        return (
+            not collection.size
+            and not lock.locked()  # type: ignore
+            and (not flush_task or flush_task.done())
+        )
 
     async def _():
         nonlocal current_progress
+
+        snapshots = {}
         for sync in settings.sync:
-            if sync.full and not await meili.index_exists(sync.index_name):
-                count = 0
-                async for items in source.get_full_data(sync, meili_settings.insert_size or 10000):
-                    count += len(items)
-                    await meili.add_data(sync, items)
-                if count:
-                    logger.info(
-                        f'Full data sync for table "{settings.source.database}.{sync.table}" '
-                        f"done! {count} documents added."
-                    )
-                else:
-                    logger.info(
-                        f'No data found for table "{settings.source.database}.{sync.table}".'
-                    )
+            if not sync.full:
+                continue
+            snapshot = Snapshot(sync.index_name, sync, source, progress, meili)
+            # an unfinished full sync is only resumed while its index is still there
+            if not await meili.index_exists(sync.index_name) or await snapshot.load():
+                snapshots[sync] = snapshot
+        snapshot_progress = None
+        if snapshots and not current_progress:
+            # the changes made during the full sync are replayed from the position before it
+            snapshot_progress = (
+                next((s.state["progress"] for s in snapshots.values() if s.state), None)
+                or await source.get_current_progress()
+            )
+
+        async def full_data(sync: Sync):
+            snapshot = snapshots[sync]
+            if snapshot.state:
+                logger.info(
+                    f'Resume full data sync for table "{settings.source.database}.{sync.table}"...'
+                )
+            else:
+                logger.info(
+                    f'Start full data sync for table "{settings.source.database}.{sync.table}"...'
+                )
+                await snapshot.create(snapshot_progress or current_progress)
+            count, _ = await meili.add_full_data(
+                sync,
+                snapshot.get_full_data(meili_settings.insert_size or 10000),
+                snapshot.on_data,
+            )
+            log_full_data(settings, sync, count)
+
+        await gather_syncs(list(snapshots), settings.concurrency, full_data)
+        if snapshot_progress:
+            source.set_progress(snapshot_progress)
+            await progress.set(**snapshot_progress)
+        for snapshot in snapshots.values():
+            await snapshot.finish()
         logger.info(f'Start increment sync data from "{settings.source.type}" to MeiliSearch...')
-        async for event in source:
+        events = source
+        if settings.spool:
+            # the source is read into the spool at full speed, the events are applied from it
+            events = Spool(**settings.spool.model_dump())
+            events.start(source)
+        async for event in events:
             if settings.debug:
                 logger.debug(event)
             current_progress = event.progress
-            if isinstance(event, Event):
+            if controller and event.timestamp:
+                controller.observe_lag(time.time() - event.timestamp)
+            if isinstance(event, (Event, EventBatch)):
                 sync = settings.get_sync(event.table)
                 if not sync:
                     continue
-                if not meili_settings.insert_size and not meili_settings.insert_interval:
-                    await meili.handle_event(event, sync)
-                    await progress.set(**current_progress)
+                if not insert_size() and not meili_settings.insert_interval:
+                    if isinstance(event, EventBatch):
+                        task = await meili.handle_data_by_type(sync, event.data, event.type)
+                    else:
+                        task = await meili.handle_event(event, sync)
+                    track([task] if task else [], current_progress)
                 else:
-                    collection.add_event(sync, event)
-                    if collection.size >= meili_settings.insert_size:
+                    if isinstance(event, EventBatch):
+                        collection.add_events(sync, event)
+                    else:
+                        collection.add_event(sync, event)
+                    if insert_size() and collection.size >= insert_size():
                         async with lock:
-                            await meili.handle_events(collection)
-                            await progress.set(**current_progress)
-            else:
-                await progress.set(**current_progress)
+                            await flush()
+            elif idle():
+                track([], current_progress)
 
     async def interval():
-        if not settings.meilisearch.insert_interval:
+        # without a fixed interval the adaptive target latency bounds how long events wait
+        period = meili_settings.insert_interval or (
+            meili_settings.adaptive and meili_settings.adaptive.target_latency
+        )
+        if not period:
             return
         while True:
-            await asyncio.sleep(settings.meilisearch.insert_interval)
+            await asyncio.sleep(period)
             try:
                 async with lock:
-                    await meili.handle_events(collection)
-                    await progress.set(**current_progress)
+                    await flush()
             except Exception as e:
+                if e is tracker.error:
+                    raise
                 logger.exception(e)
                 logger.error(f"Error when insert data to MeiliSearch: {e}")
 
     async def run():
         nonlocal lock
         lock = asyncio.Lock()
-        await asyncio.gather(_(), interval())
+        try:
+            await asyncio.gather(_(), interval())
+        finally:
+            await checkpointer.flush()
 
     asyncio.run(run())
 
@@ -155,23 +295,35 @@ def refresh(
         source = context.obj["source"]
         meili = context.obj["meili"]
         progress = context.obj["progress"]
+        snapshots = {}
         for sync in settings.sync:
             if not table or sync.table in table:
-                current_progress = await source.get_current_progress()
-                await progress.set(**current_progress)
-                count = await meili.refresh_data(
-                    sync,
-                    source.get_full_data(sync, size),
-                )
-                if count:
-                    logger.info(
-                        f'Full data sync for table "{settings.source.database}.{sync.table}" '
-                        f"done! {count} documents added."
-                    )
-                else:
-                    logger.info(
-                        f'No data found for table "{settings.source.database}.{sync.table}".'
-                    )
+                snapshot = Snapshot(f"{sync.index_name}_refresh", sync, source, progress, meili)
+                # a refresh is only resumed while its tmp index is still there
+                if await snapshot.load() and not await meili.index_exists(f"{sync.index_name}_tmp"):
+                    snapshot.state = None
+                snapshots[sync] = snapshot
+        current_progress = (
+            next((s.state["progress"] for s in snapshots.values() if s.state), None)
+            or await source.get_current_progress()
+        )
+        await progress.set(**current_progress)
+
+        async def refresh_data(sync: Sync):
+            snapshot = snapshots[sync]
+            resume = bool(snapshot.state)
+            if resume:
+                logger.info(f'Resume refresh table "{settings.source.database}.{sync.table}"...')
+            else:
+                logger.info(f'Start refresh table "{settings.source.database}.{sync.table}"...')
+                await snapshot.create(current_progress)
+            count = await meili.refresh_data(
+                sync, snapshot.get_full_data(size), snapshot.on_data, resume=resume
+            )
+            await snapshot.finish()
+            log_full_data(settings, sync, count)
+
+        await gather_syncs(list(snapshots), settings.concurrency, refresh_data)
 
     asyncio.run(_())
 
@@ -184,26 +336,55 @@ def check(
     table: Optional[List[str]] = typer.Option(
         None, "-t", "--table", help="Table name, if not set, all tables"
     ),
+    checksum: bool = typer.Option(
+        False, "--checksum", help="Compare the documents by hash instead of only the count"
+    ),
+    repair: bool = typer.Option(
+        False, "--repair", help="Send again the documents that differ, implies --checksum"
+    ),
+    size: int = typer.Option(
+        1000, "-s", "--size", help="Number of documents compared in each chunk"
+    ),
 ):
     async def _():
         settings = context.obj["settings"]
         source = context.obj["source"]
         meili = context.obj["meili"]
-        for sync in settings.sync:
-            if not table or sync.table in table:
-                count = await source.get_count(sync)
-                meili_count = await meili.get_count(sync.index_name)
-                if count == meili_count:
-                    logger.info(
-                        f'Table "{settings.source.database}.{sync.table}" '
-                        f"is consistent with MeiliSearch, count: {count}."
-                    )
+
+        async def check_data(sync: Sync):
+            if checksum or repair:
+                result = await Checksum(source, meili, sync, size).run(repair)
+                message = (
+                    f'Table "{settings.source.database}.{sync.table}" checked {result.checked} '
+                    f"documents in {result.chunks} chunks, {result.mismatched_chunks} chunks "
+                    f"mismatched, different: {result.different}, missing: {result.missing}, "
+                    f"extra: {result.extra}, repaired: {result.repaired}."
+                )
+                if result.different or result.missing or result.extra:
+                    logger.error(message)
                 else:
-                    logger.error(
-                        f'Table "{settings.source.database}.{sync.table}" is inconsistent '
-                        f"with MeiliSearch, Database count: {count}, "
-                        f'MeiliSearch count: {meili_count}."'
-                    )
+                    logger.info(message)
+                return
+            count, meili_count = await asyncio.gather(
+                source.get_count(sync), meili.get_count(sync.index_name)
+            )
+            if count == meili_count:
+                logger.info(
+                    f'Table "{settings.source.database}.{sync.table}" '
+                    f"is consistent with MeiliSearch, count: {count}."
+                )
+            else:
+                logger.error(
+                    f'Table "{settings.source.database}.{sync.table}" is inconsistent '
+                    f"with MeiliSearch, Database count: {count}, "
+                    f'MeiliSearch count: {meili_count}."'
+                )
+
+        await gather_syncs(
+            [sync for sync in settings.sync if not table or sync.table in table],
+            settings.concurrency,
+            check_data,
+        )
 
     asyncio.run(_())
 
@@ -1,15 +1,194 @@
 import asyncio
-from typing import AsyncGenerator, List, Optional, Type, Union
+import json
+import zlib
+from collections import deque
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from loguru import logger
 from meilisearch_python_sdk import AsyncClient
-from meilisearch_python_sdk.errors import MeilisearchApiError
+from meilisearch_python_sdk.errors import (
+    MeilisearchApiError,
+    MeilisearchCommunicationError,
+    MeilisearchTimeoutError,
+)
+from meilisearch_python_sdk.models.task import TaskInfo, TaskResult
 
-from meilisync.enums import EventType
-from meilisync.event import EventCollection
+from meilisync.enums import CompressionType, EventType
 from meilisync.plugin import Plugin
 from meilisync.schemas import Event
-from meilisync.settings import Sync
+from meilisync.settings import AdaptiveInsert, Sync
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+NDJSON_CHUNK_SIZE = 64 * 1024
+
+
+def dump_line(doc: dict) -> bytes:
+    if orjson:
+        return orjson.dumps(doc, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(doc, ensure_ascii=False, default=str).encode() + b"\n"
+
+
+async def ndjson_body(docs: Iterable[dict], compression: Optional[CompressionType] = None):
+    compressor = None
+    if compression == CompressionType.gzip:
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    elif compression == CompressionType.deflate:
+        compressor = zlib.compressobj()
+    buf = bytearray()
+    for doc in docs:
+        buf += dump_line(doc)
+        if len(buf) < NDJSON_CHUNK_SIZE:
+            continue
+        # an empty chunk would end the chunked request body
+        if chunk := compressor.compress(buf) if compressor else bytes(buf):
+            yield chunk
+        buf.clear()
+    if chunk := (compressor.compress(buf) + compressor.flush()) if compressor else bytes(buf):
+        yield chunk
+
+
+class InsertSizeController:
+    def __init__(self, settings: AdaptiveInsert):
+        self.settings = settings
+        self.size = settings.min_size
+        self.catch_up = False
+
+    @property
+    def insert_size(self):
+        return self.settings.max_size if self.catch_up else self.size
+
+    def observe_lag(self, lag: float):
+        catch_up = lag > self.settings.catch_up_lag
+        if catch_up != self.catch_up:
+            if catch_up:
+                logger.info(f"Source lag is {lag:.0f}s, switch to catch-up batches")
+            else:
+                logger.info("Source lag recovered, switch to adaptive batches")
+            self.catch_up = catch_up
+
+    def observe_tasks(self, tasks: List[TaskResult], pending: int):
+        latencies = [
+            (task.finished_at - task.enqueued_at).total_seconds()
+            for task in tasks
+            if task.finished_at and task.enqueued_at
+        ]
+        if not latencies:
+            return
+        latency = max(latencies)
+        settings = self.settings
+        if latency > settings.target_latency or pending > settings.max_pending:
+            # MeiliSearch is queueing up, fewer but larger batches are cheaper to index
+            self.size = min(self.size * 2, settings.max_size)
+        elif latency < settings.target_latency / 2:
+            self.size = max(self.size * 3 // 4, settings.min_size)
+
+
+class TaskTracker:
+    def __init__(
+        self,
+        client: AsyncClient,
+        on_commit: Callable[[Any], Awaitable],
+        interval: float = 1,
+        batch_size: int = 1000,
+        on_finished: Optional[Callable[[List[TaskResult], int], None]] = None,
+    ):
+        self.client = client
+        self.on_commit = on_commit
+        self.on_finished = on_finished
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Deque[Tuple[Set[int], Any]] = deque()
+        self._poller: Optional[asyncio.Task] = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def size(self):
+        return len(self._pending)
+
+    def add(self, tasks: List[TaskInfo], value: Any):
+        if self.error:
+            raise self.error
+        self._pending.append(({task.task_uid for task in tasks}, value))
+        if not self._poller or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+
+    def fail(self, error: Exception):
+        # nothing is committed anymore, the first error is kept
+        if not self.error:
+            self.error = error
+
+    async def join(self):
+        while self._poller and not self._poller.done():
+            await asyncio.shield(self._poller)
+        if self.error:
+            raise self.error
+
+    async def _commit(self):
+        value = committed = None
+        while self._pending and not self._pending[0][0]:
+            _, value = self._pending.popleft()
+            committed = True
+        if committed:
+            await self.on_commit(value)
+
+    async def _poll(self):
+        await self._commit()
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            uids = []
+            for task_uids, _ in self._pending:
+                uids.extend(task_uids)
+                if len(uids) >= self.batch_size:
+                    break
+            try:
+                status = await self.client.get_tasks(
+                    uids=uids,
+                    statuses=["succeeded", "failed", "canceled"],
+                    limit=len(uids),
+                )
+            except Exception as e:
+                if isinstance(e, (MeilisearchCommunicationError, MeilisearchTimeoutError)) or (
+                    isinstance(e, MeilisearchApiError) and e.status_code >= 500
+                ):
+                    # the server is unavailable for now, the tasks are polled again
+                    logger.warning(f"Error when get MeiliSearch tasks status: {e}")
+                    continue
+                logger.exception(f"Error when get MeiliSearch tasks status: {e}")
+                self.fail(e)
+                return
+            succeeded = set()
+            for task in status.results:
+                if task.status == "succeeded":
+                    succeeded.add(task.uid)
+                elif not self.error:
+                    logger.error(f"MeiliSearch task {task.uid} {task.status}: {task.error}")
+                    self.error = RuntimeError(f"MeiliSearch task {task.uid} {task.status}")
+            for task_uids, _ in self._pending:
+                task_uids -= succeeded
+            if self.on_finished:
+                self.on_finished(status.results, sum(len(uids) for uids, _ in self._pending))
+            # a failed task stays pending, nothing after it is committed
+            await self._commit()
+            if self.error:
+                return
 
 
 class Meili:
@@ -19,40 +198,97 @@ class Meili:
         api_key: str,
         plugins: Optional[List[Union[Type[Plugin], Plugin]]] = None,
         wait_for_task_timeout: Optional[int] = None,
+        max_tasks: Optional[int] = None,
+        flush_concurrency: int = 10,
+        ndjson: bool = False,
+        compression: Optional[CompressionType] = None,
     ):
         self.client = AsyncClient(
             api_url,
             api_key,
         )
+        self.ndjson = ndjson
+        self.compression = compression
         self.plugins = plugins or []
         self.wait_for_task_timeout = wait_for_task_timeout
+        self.flush_concurrency = flush_concurrency
+        self.tasks_semaphore = asyncio.Semaphore(max_tasks) if max_tasks else None
+        self._release_tasks: Set[asyncio.Task] = set()
+
+    async def _release_task(self, task: TaskInfo):
+        try:
+            await self.client.wait_for_task(
+                task_id=task.task_uid, timeout_in_ms=None, interval_in_ms=500
+            )
+        finally:
+            self.tasks_semaphore.release()  # type: ignore
 
     async def add_data(self, sync: Sync, data: list):
-        events = [Event(type=EventType.create, data=item) for item in data]
-        return await self.handle_events_by_type(sync, events, EventType.create)
+        if not self.tasks_semaphore:
+            return await self.handle_data_by_type(sync, data, EventType.create)
+        await self.tasks_semaphore.acquire()
+        try:
+            task = await self.handle_data_by_type(sync, data, EventType.create)
+        except BaseException:
+            self.tasks_semaphore.release()
+            raise
+        if not task:
+            self.tasks_semaphore.release()
+            return task
+        release_task = asyncio.ensure_future(self._release_task(task))
+        self._release_tasks.add(release_task)
+        release_task.add_done_callback(self._release_tasks.discard)
+        return task
+
+    async def add_full_data(
+        self,
+        sync: Sync,
+        data: List[AsyncGenerator],
+        on_data: Optional[Callable[[int, list, Optional[TaskInfo]], None]] = None,
+    ):
+        count = 0
 
-    async def refresh_data(self, sync: Sync, data: AsyncGenerator):
+        async def _(i: int, items_iter: AsyncGenerator):
+            nonlocal count
+            tasks = []
+            async for items in items_iter:
+                task = await self.add_data(sync, items)
+                tasks.append(task)
+                count += len(items)
+                if on_data:
+                    on_data(i, items, task)
+                logger.debug(f'Full data sync for index "{sync.index_name}": {count} documents')
+            return tasks
+
+        ret = await asyncio.gather(*[_(i, items_iter) for i, items_iter in enumerate(data)])
+        return count, [task for tasks in ret for task in tasks]
+
+    async def refresh_data(
+        self,
+        sync: Sync,
+        data: List[AsyncGenerator],
+        on_data: Optional[Callable[[int, list, Optional[TaskInfo]], None]] = None,
+        resume: bool = False,
+    ):
         index = sync.index_name
         pk = sync.pk
         sync.index = index_name_tmp = f"{index}_tmp"
-        try:
-            await self.client.index(index_name_tmp).delete()
-        except MeilisearchApiError as e:
-            if e.code != "MeilisearchApiError.index_not_found":
-                raise
-        settings = await self.client.index(index).get_settings()
-        index_tmp = await self.client.create_index(index_name_tmp, primary_key=pk)
-        task = await index_tmp.update_settings(settings)
-        logger.info(f"Waiting for update tmp index {index_name_tmp} settings to complete...")
-        await self.client.wait_for_task(
-            task_id=task.task_uid, timeout_in_ms=self.wait_for_task_timeout
-        )
-        tasks = []
-        count = 0
-        async for items in data:
-            task = await self.add_data(sync, items)
-            tasks.append(task)
-            count += len(items)
+        if resume and await self.index_exists(index_name_tmp):
+            logger.info(f"Resume refresh with tmp index {index_name_tmp}...")
+        else:
+            try:
+                await self.client.index(index_name_tmp).delete()
+            except MeilisearchApiError as e:
+                if e.code != "MeilisearchApiError.index_not_found":
+                    raise
+            settings = await self.client.index(index).get_settings()
+            index_tmp = await self.client.create_index(index_name_tmp, primary_key=pk)
+            task = await index_tmp.update_settings(settings)
+            logger.info(f"Waiting for update tmp index {index_name_tmp} settings to complete...")
+            await self.client.wait_for_task(
+                task_id=task.task_uid, timeout_in_ms=self.wait_for_task_timeout
+            )
+        count, tasks = await self.add_full_data(sync, data, on_data)
         wait_tasks = [
             self.client.wait_for_task(
                 task_id=item.task_uid, timeout_in_ms=self.wait_for_task_timeout
@@ -83,69 +319,109 @@ class Meili:
                 return False
             raise e
 
-    async def handle_events(self, collection: EventCollection):
-        created_events, updated_events, deleted_events = collection.pop_events
-        for sync, events in created_events.items():
-            await self.handle_events_by_type(sync, events, EventType.create)
-        for sync, events in updated_events.items():
-            await self.handle_events_by_type(sync, events, EventType.update)
-        for sync, events in deleted_events.items():
-            await self.handle_events_by_type(sync, events, EventType.delete)
+    async def flush_events(
+        self,
+        created_events: Dict[Sync, List[dict]],
+        updated_events: Dict[Sync, List[dict]],
+        deleted_events: Dict[Sync, List[dict]],
+    ):
+        semaphore = asyncio.Semaphore(self.flush_concurrency)
+
+        async def _(sync: Sync):
+            # requests of the same index are sent in order
+            tasks = []
+            async with semaphore:
+                for events, event_type in (
+                    (created_events.get(sync), EventType.create),
+                    (updated_events.get(sync), EventType.update),
+                    (deleted_events.get(sync), EventType.delete),
+                ):
+                    if events:
+                        tasks.append(await self.handle_data_by_type(sync, events, event_type))
+            return tasks
+
+        syncs = {**created_events, **updated_events, **deleted_events}
+        ret = await asyncio.gather(*[_(sync) for sync in syncs])
+        return [task for tasks in ret for task in tasks if task]
+
+    def get_plugins(self, sync: Sync):
+        for plugin in [*self.plugins, *sync.plugins_cls()]:
+            yield plugin if isinstance(plugin, Plugin) else plugin()
 
     async def handle_plugins_pre(self, sync: Sync, event: Event):
-        for plugin in self.plugins:
-            if isinstance(plugin, Plugin):
-                event = await plugin.pre_event(event)
-            else:
-                event = await plugin().pre_event(event)
-        for plugin in sync.plugins_cls():
-            if isinstance(plugin, Plugin):
-                event = await plugin.pre_event(event)
-            else:
-                event = await plugin().pre_event(event)
+        for plugin in self.get_plugins(sync):
+            event = await plugin.pre_event(event)
         return event
 
     async def handle_plugins_post(self, sync: Sync, event: Event):
-        for plugin in self.plugins:
-            if isinstance(plugin, Plugin):
-                event = await plugin.post_event(event)
-            else:
-                event = await plugin().post_event(event)
-        for plugin in sync.plugins_cls():
-            if isinstance(plugin, Plugin):
-                event = await plugin.post_event(event)
-            else:
-                event = await plugin().post_event(event)
+        for plugin in self.get_plugins(sync):
+            event = await plugin.post_event(event)
         return event
 
+    async def handle_plugins_pre_batch(self, sync: Sync, events: List[Event]):
+        for plugin in self.get_plugins(sync):
+            events = await plugin.pre_batch(events)
+        return events
+
+    async def handle_plugins_post_batch(self, sync: Sync, events: List[Event]):
+        for plugin in self.get_plugins(sync):
+            events = await plugin.post_batch(events)
+        return events
+
+    async def handle_data_by_type(self, sync: Sync, data: List[dict], event_type: EventType):
+        if not data:
+            return
+        if not self.plugins and not sync.plugins_cls():
+            return await self.send_data(sync, data, event_type)
+        # plugins get events
+        events = [Event(type=event_type, table=sync.table, data=item) for item in data]
+        return await self.handle_events_by_type(sync, events, event_type)
+
     async def handle_events_by_type(self, sync: Sync, events: List[Event], event_type: EventType):
         if not events:
             return
+        events = await self.handle_plugins_pre_batch(sync, events)
+        task = await self.send_data(sync, [event.data for event in events], event_type)
+        await self.handle_plugins_post_batch(sync, events)
+        return task
+
+    async def send_data(self, sync: Sync, data: List[dict], event_type: EventType):
         index = self.client.index(sync.index_name)
-        for event in events:
-            await self.handle_plugins_pre(sync, event)
-        task = None
+        if event_type == EventType.delete:
+            return await index.delete_documents([str(item[sync.pk]) for item in data])
+        if self.ndjson:
+            return await self.send_documents(sync, data, event_type == EventType.update)
         if event_type == EventType.create:
-            task = await index.add_documents(
-                [event.mapping_data(sync.fields) for event in events], primary_key=sync.pk
-            )
-        elif event_type == EventType.update:
-            task = await index.update_documents(
-                [event.mapping_data(sync.fields) for event in events], primary_key=sync.pk
-            )
-        elif event_type == EventType.delete:
-            task = await index.delete_documents([str(event.data[sync.pk]) for event in events])
-        for event in events:
-            await self.handle_plugins_post(sync, event)
-        return task
+            return await index.add_documents(sync.transform(data), primary_key=sync.pk)
+        return await index.update_documents(sync.transform(data), primary_key=sync.pk)
+
+    async def send_documents(self, sync: Sync, data: List[dict], update: bool = False):
+        """
+        Stream the documents as NDJSON, they are serialized while the request body is sent.
+        """
+        headers = {"Content-Type": "application/x-ndjson"}
+        if self.compression:
+            headers["Content-Encoding"] = self.compression.value
+        http_client = self.client.http_client
+        response = await (http_client.put if update else http_client.post)(
+            f"indexes/{sync.index_name}/documents",
+            params={"primaryKey": sync.pk},
+            content=ndjson_body(sync.transformer.iter(data), self.compression),
+            headers=headers,
+        )
+        if response.is_error:
+            raise MeilisearchApiError(f"Send documents to {sync.index_name} failed", response)
+        return TaskInfo(**response.json())
 
     async def handle_event(self, event: Event, sync: Sync):
         event = await self.handle_plugins_pre(sync, event)
         index = self.client.index(sync.index_name)
+        task = None
         if event.type == EventType.create:
-            await index.add_documents([event.mapping_data(sync.fields)], primary_key=sync.pk)
+            task = await index.add_documents(sync.transform([event.data]), primary_key=sync.pk)
         elif event.type == EventType.update:
-            await index.update_documents([event.mapping_data(sync.fields)], primary_key=sync.pk)
+            task = await index.update_documents(sync.transform([event.data]), primary_key=sync.pk)
         elif event.type == EventType.delete:
-            await index.delete_documents([str(event.data[sync.pk])])
+            task = await index.delete_documents([str(event.data[sync.pk])])
         await self.handle_plugins_post(sync, event)
+        return task
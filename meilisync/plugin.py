@@ -1,4 +1,5 @@
 import importlib
+from typing import List
 
 from loguru import logger
 
@@ -16,6 +17,12 @@ class Plugin:
         logger.debug(f"post_event: {event}, is_global: {self.is_global}")
         return event
 
+    async def pre_batch(self, events: List[Event]):
+        return [await self.pre_event(event) for event in events]
+
+    async def post_batch(self, events: List[Event]):
+        return [await self.post_event(event) for event in events]
+
 
 def load_plugin(module_str: str):
     module, _, class_name = module_str.rpartition(".")
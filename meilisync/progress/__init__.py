@@ -1,3 +1,7 @@
+import asyncio
+import time
+from typing import Optional
+
 from meilisync.enums import ProgressType
 
 
@@ -12,3 +16,49 @@ class Progress:
 
     async def get(self):
         raise NotImplementedError
+
+    async def get_snapshot(self, name: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def set_snapshot(self, name: str, state: Optional[dict]):
+        """
+        Store the full sync state of an index, `None` removes it.
+        """
+        raise NotImplementedError
+
+
+class Checkpointer:
+    """
+    Coalesce progress writes, only the latest progress is stored, at most every `interval` ms or
+    every `size` updates.
+    """
+
+    def __init__(self, progress: Progress, interval: int = 1000, size: int = 1000):
+        self.progress = progress
+        self.interval = interval / 1000
+        self.size = size
+        self._pending: Optional[dict] = None
+        self._count = 0
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def set(self, **kwargs):
+        self._pending = kwargs
+        self._count += 1
+        if self._count >= self.size or time.monotonic() - self._last >= self.interval:
+            await self.flush()
+        elif not self._timer or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval - (time.monotonic() - self._last))
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            pending, self._pending = self._pending, None
+            self._count = 0
+            self._last = time.monotonic()
+            if pending is not None:
+                await self.progress.set(**pending)
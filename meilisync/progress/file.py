@@ -1,4 +1,6 @@
 import json
+import os
+from typing import Optional
 
 import aiofiles
 import aiofiles.os
@@ -17,13 +19,38 @@ class File(Progress):
         super().__init__(path=path)
         self.path = path
 
-    async def set(self, **kwargs):
-        async with aiofiles.open(self.path, "w") as f:
-            await f.write(json.dumps(kwargs))
+    @staticmethod
+    async def _write(path: str, value: dict):
+        tmp = f"{path}.tmp"
+        async with aiofiles.open(tmp, "w") as f:
+            await f.write(json.dumps(value))
+        await aiofiles.os.replace(tmp, path)
 
-    async def get(self):
+    @staticmethod
+    async def _read(path: str):
         try:
-            async with aiofiles.open(self.path) as f:
+            async with aiofiles.open(path) as f:
                 return json.loads(await f.read())
         except FileNotFoundError:
             return None
+
+    def _snapshot_path(self, name: str):
+        return f"{os.path.splitext(self.path)[0]}.snapshot.{name}.json"
+
+    async def set(self, **kwargs):
+        await self._write(self.path, kwargs)
+
+    async def get(self):
+        return await self._read(self.path)
+
+    async def get_snapshot(self, name: str):
+        return await self._read(self._snapshot_path(name))
+
+    async def set_snapshot(self, name: str, state: Optional[dict]):
+        if state is not None:
+            await self._write(self._snapshot_path(name), state)
+            return
+        try:
+            await aiofiles.os.remove(self._snapshot_path(name))
+        except FileNotFoundError:
+            pass
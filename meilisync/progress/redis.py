@@ -1,3 +1,6 @@
+import json
+from typing import Optional
+
 import redis.asyncio as redis
 
 from meilisync.enums import ProgressType
@@ -17,7 +20,20 @@ class Redis(Progress):
         self.redis = redis.from_url(dsn, decode_responses=True)
 
     async def set(self, **kwargs):
-        await self.redis.hmset(self.key, kwargs)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self.key)
+            pipe.hset(self.key, mapping=kwargs)
+            await pipe.execute()
 
     async def get(self):
         return await self.redis.hgetall(self.key)
+
+    async def get_snapshot(self, name: str):
+        state = await self.redis.get(f"{self.key}:snapshot:{name}")
+        return json.loads(state) if state else None
+
+    async def set_snapshot(self, name: str, state: Optional[dict]):
+        if state is None:
+            await self.redis.delete(f"{self.key}:snapshot:{name}")
+        else:
+            await self.redis.set(f"{self.key}:snapshot:{name}", json.dumps(state))
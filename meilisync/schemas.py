@@ -1,30 +1,96 @@
 import datetime
-from typing import Optional
-
-from pydantic import BaseModel
+import decimal
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 from meilisync.enums import EventType
 
+CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    datetime.datetime: lambda v: int(v.timestamp()),
+    datetime.date: str,
+    decimal.Decimal: float,
+    bytes: lambda v: v.decode(errors="replace"),
+    uuid.UUID: str,
+}
+# rows read in a raw form, decoded as a whole before their values are converted
+DECODERS: Dict[type, Callable[[Any], dict]] = {}
+
+
+def register_converter(type_: type, converter: Callable[[Any], Any]):
+    CONVERTERS[type_] = converter
+
+
+def register_decoder(type_: type, decoder: Callable[[Any], dict]):
+    DECODERS[type_] = decoder
+
+
+class Transformer:
+    __slots__ = ("fields",)
+
+    def __init__(self, fields_mapping: Optional[dict] = None):
+        if fields_mapping is None:
+            self.fields = None
+        else:
+            self.fields = [(k, v or k) for k, v in fields_mapping.items()]
+
+    def _convert(self, data: dict):
+        decoder = DECODERS.get(type(data))
+        if decoder:
+            data = decoder(data)
+        converters = CONVERTERS
+        ret = {}
+        for k, v in data.items():
+            converter = converters.get(type(v))
+            ret[k] = converter(v) if converter else v
+        return ret
 
-class ProgressEvent(BaseModel):
+    def _project(self, data: dict):
+        decoder = DECODERS.get(type(data))
+        if decoder:
+            data = decoder(data)
+        converters = CONVERTERS
+        ret = {}
+        for k, real_k in self.fields:  # type: ignore
+            if k in data:
+                v = data[k]
+            elif real_k in data:
+                # full data rows are already renamed by the query
+                v = data[real_k]
+            else:
+                continue
+            converter = converters.get(type(v))
+            ret[real_k] = converter(v) if converter else v
+        return ret or self._convert(data)
+
+    def __call__(self, rows: List[dict]) -> List[dict]:
+        if self.fields is None:
+            return [self._convert(data) for data in rows]
+        return [self._project(data) for data in rows]
+
+    def iter(self, rows: Iterable[dict]) -> Iterator[dict]:
+        convert = self._convert if self.fields is None else self._project
+        return map(convert, rows)
+
+
+@dataclass(slots=True, kw_only=True)
+class ProgressEvent:
     progress: dict | None = None
+    timestamp: float | None = None
 
 
+@dataclass(slots=True, kw_only=True)
 class Event(ProgressEvent):
     type: EventType
     table: str | None = None
     data: dict
 
     def mapping_data(self, fields_mapping: Optional[dict] = None):
-        data = {}
-        for k, v in self.data.items():
-            if isinstance(v, datetime.datetime):
-                v = int(v.timestamp())
-            elif isinstance(v, datetime.date):
-                v = str(v)
-            if fields_mapping is not None and k in fields_mapping:
-                real_k = fields_mapping[k] or k
-                data[real_k] = v
-            elif fields_mapping is None:
-                data[k] = v
-        return data or self.data
+        return Transformer(fields_mapping)([self.data])[0]
+
+
+@dataclass(slots=True, kw_only=True)
+class EventBatch(ProgressEvent):
+    type: EventType
+    table: str | None = None
+    data: List[dict]
@@ -1,10 +1,11 @@
 from typing import List
 
-from pydantic import BaseModel, Extra
+from pydantic import BaseModel, Extra, PrivateAttr
 from pydantic_settings import BaseSettings
 
-from meilisync.enums import ProgressType, SourceType
+from meilisync.enums import CompressionType, PaginationType, ProgressType, SourceType
 from meilisync.plugin import load_plugin
+from meilisync.schemas import Transformer
 
 
 class Source(BaseModel):
@@ -15,25 +16,41 @@ class Source(BaseModel):
         extra = Extra.allow
 
 
+class AdaptiveInsert(BaseModel):
+    min_size: int = 100
+    max_size: int = 10000
+    target_latency: float = 1
+    max_pending: int = 10
+    catch_up_lag: int = 60
+
+
 class MeiliSearch(BaseModel):
     api_url: str
     api_key: str | None = None
     insert_size: int | None = None
     insert_interval: int | None = None
+    max_tasks: int | None = None
+    flush_concurrency: int = 10
+    adaptive: AdaptiveInsert | None = None
+    ndjson: bool = False
+    compression: CompressionType | None = None
 
 
 class BasePlugin(BaseModel):
     plugins: List[str] = []
+    _plugins_cls: list | None = PrivateAttr(default=None)
 
     def plugins_cls(self):
-        plugins = []
-        for plugin in self.plugins or []:
-            p = load_plugin(plugin)
-            if p.is_global:
-                plugins.append(p())
-            else:
-                plugins.append(p)
-        return plugins
+        if self._plugins_cls is None:
+            plugins = []
+            for plugin in self.plugins or []:
+                p = load_plugin(plugin)
+                if p.is_global:
+                    plugins.append(p())
+                else:
+                    plugins.append(p)
+            self._plugins_cls = plugins
+        return self._plugins_cls
 
 
 class Sync(BasePlugin):
@@ -42,22 +59,60 @@ class Sync(BasePlugin):
     full: bool = False
     index: str | None = None
     fields: dict | None = None
+    pagination: PaginationType = PaginationType.keyset
+    parallel: int = 1
+    _transformer: Transformer | None = PrivateAttr(default=None)
 
     @property
     def index_name(self):
         return self.index or self.table
 
+    @property
+    def keyset(self):
+        return self.pagination != PaginationType.offset and (
+            not self.fields or self.pk in self.fields
+        )
+
+    @property
+    def columns(self):
+        if self.fields:
+            return {*self.fields, self.pk}
+        return None
+
+    @property
+    def transformer(self) -> Transformer:
+        if self._transformer is None:
+            self._transformer = Transformer(self.fields)
+        return self._transformer
+
+    def transform(self, rows: List[dict]):
+        return self.transformer(rows)
+
+    @property
+    def pk_field(self):
+        if self.fields:
+            return self.fields.get(self.pk) or self.pk
+        return self.pk
+
     def __hash__(self):
         return hash(self.table)
 
 
 class Progress(BaseModel):
     type: ProgressType
+    checkpoint_interval: int = 1000
+    checkpoint_size: int = 1000
 
     class Config:
         extra = Extra.allow
 
 
+class Spool(BaseModel):
+    path: str = "spool"
+    segment_size: int = 64 * 1024 * 1024
+    max_size: int | None = None
+
+
 class Sentry(BaseModel):
     dsn: str
     environment: str = "production"
@@ -70,11 +125,17 @@ class Settings(BaseSettings, BasePlugin):
     meilisearch: MeiliSearch
     sync: List[Sync]
     sentry: Sentry | None = None
+    spool: Spool | None = None
+    concurrency: int = 1
 
     @property
     def tables(self):
         return [sync.table for sync in self.sync]
 
+    @property
+    def columns(self):
+        return {sync.table: sync.columns for sync in reversed(self.sync)}
+
     def get_sync(self, table: str):
         for sync in self.sync:
             if sync.table == table:
@@ -0,0 +1,69 @@
+import copy
+from typing import AsyncGenerator, List, Optional
+
+from meilisearch_python_sdk.models.task import TaskInfo
+
+from meilisync.meili import Meili, TaskTracker
+from meilisync.progress import Progress
+from meilisync.settings import Sync
+from meilisync.source import Source
+
+
+class Snapshot:
+    """
+    Full sync state of an index: the source position captured when it started and the last
+    primary key of each range, stored once MeiliSearch has processed the documents before it.
+    """
+
+    def __init__(self, name: str, sync: Sync, source: Source, progress: Progress, meili: Meili):
+        self.name = name
+        self.sync = sync
+        self.source = source
+        self.progress = progress
+        self.state: Optional[dict] = None
+        self.tracker = TaskTracker(meili.client, self._save)
+        self._ranges: List[dict] = []
+
+    async def _save(self, state: dict):
+        await self.progress.set_snapshot(self.name, state)
+
+    async def load(self):
+        self.state = await self.progress.get_snapshot(self.name)
+        return self.state
+
+    async def create(self, source_progress: Optional[dict]):
+        self.state = {
+            "progress": source_progress,
+            "ranges": [
+                {
+                    "start": self.source.dump_key(start),
+                    "end": self.source.dump_key(end),
+                    "last": None,
+                    "done": False,
+                }
+                for start, end in await self.source.get_ranges(self.sync)
+            ],
+        }
+        await self._save(self.state)
+
+    def get_full_data(self, size: int):
+        self._ranges = [r for r in self.state["ranges"] if not r["done"]]  # type: ignore
+        return [self._get_range_data(r, size) for r in self._ranges]
+
+    async def _get_range_data(self, r: dict, size: int) -> AsyncGenerator:
+        start = r["start"] if r["last"] is None else r["last"]
+        async for items in self.source.get_full_data(
+            self.sync, size, self.source.load_key(start), self.source.load_key(r["end"])
+        ):
+            yield items
+        r["done"] = True
+        self.tracker.add([], copy.deepcopy(self.state))
+
+    def on_data(self, i: int, items: list, task: Optional[TaskInfo]):
+        if self.sync.keyset and items:
+            self._ranges[i]["last"] = self.source.dump_key(items[-1][self.sync.pk_field])
+        self.tracker.add([task] if task else [], copy.deepcopy(self.state))
+
+    async def finish(self):
+        await self.tracker.join()
+        await self.progress.set_snapshot(self.name, None)
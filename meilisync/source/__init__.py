@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
 
 from meilisync.enums import SourceType
 from meilisync.settings import Sync
@@ -11,26 +11,83 @@ class Source:
         self,
         progress: dict,
         tables: List[str],
+        columns: Optional[Dict[str, Optional[Set[str]]]] = None,
         **kwargs,
     ):
         self.kwargs = kwargs
         self.tables = tables
         self.progress = progress
+        self.columns = columns or {}
 
     async def __aiter__(self):
         raise NotImplementedError
 
-    async def get_full_data(self, sync: Sync, size: int):
+    def get_full_data(self, sync: Sync, size: int, start=None, end=None) -> AsyncGenerator:
         raise NotImplementedError
 
+    async def get_ranges(self, sync: Sync) -> List[Tuple[Any, Any]]:
+        return [(None, None)]
+
     async def get_current_progress(self):
         raise NotImplementedError
 
+    def set_progress(self, progress: dict):
+        self.progress = progress
+
+    def dump_key(self, key: Any):
+        """
+        Convert a primary key to a JSON value for the full sync state.
+        """
+        return key
+
+    def load_key(self, key: Any):
+        return key
+
     async def get_count(self, sync: Sync):
         raise NotImplementedError
 
+    async def get_existing_keys(self, sync: Sync, keys: List[Any]) -> Set[str]:
+        """
+        Return which of the primary keys are in the table, as strings.
+        """
+        raise NotImplementedError
+
     async def ping(self):
         raise NotImplementedError
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         raise NotImplementedError
+
+
+def to_ranges(points: Optional[List[Any]]) -> List[Tuple[Any, Any]]:
+    bounds = [None, *sorted(set(points or [])), None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def split_range(min_: Any, max_: Any, parallel: int) -> Optional[List[Any]]:
+    if type(min_) is not int or type(max_) is not int:
+        return None
+    return [min_ + (max_ - min_) * i // parallel for i in range(1, parallel)]
+
+
+def quantiles(values: List[Any], parallel: int) -> List[Any]:
+    values = sorted(values)
+    return [values[len(values) * i // parallel] for i in range(1, parallel)] if values else []
+
+
+def range_condition(pk: str, start: Any, end: Any, numbered: bool = False) -> Tuple[str, list]:
+    conditions: List[str] = []
+    args: List[Any] = []
+
+    def placeholder():
+        return f"${len(args)}" if numbered else "%s"
+
+    if start is not None:
+        args.append(start)
+        conditions.append(f"{pk} > {placeholder()}")
+    if end is not None:
+        args.append(end)
+        conditions.append(f"{pk} <= {placeholder()}")
+    if not conditions:
+        return "", args
+    return f"WHERE {' AND '.join(conditions)} ", args
@@ -1,32 +1,70 @@
-from typing import List
+from typing import Any, Dict, List, Optional
 
+import bson
 import motor.motor_asyncio
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import OperationFailure
 
 from meilisync.enums import EventType, SourceType
-from meilisync.schemas import Event
+from meilisync.schemas import Event, register_converter, register_decoder
 from meilisync.settings import Sync
-from meilisync.source import Source
+from meilisync.source import Source, quantiles, to_ranges
 
 
 class Mongo(Source):
     type = SourceType.mongo
 
-    def __init__(self, progress: dict, tables: List[str], **kwargs):
+    def __init__(
+        self,
+        progress: dict,
+        tables: List[str],
+        batch_size: Optional[int] = None,
+        max_await_time_ms: Optional[int] = None,
+        update_lookup: bool = False,
+        raw_bson: bool = False,
+        **kwargs,
+    ):
         super().__init__(progress, tables, **kwargs)
-        database = self.kwargs.pop("database")
+        self.batch_size = batch_size
+        self.max_await_time_ms = max_await_time_ms
+        self.update_lookup = update_lookup
+        self.raw_bson = raw_bson
+        register_converter(ObjectId, str)
+        if raw_bson:
+            # nested documents and arrays are decoded with the document
+            register_decoder(RawBSONDocument, lambda doc: bson.decode(doc.raw))
+        self.database = self.kwargs.pop("database")
         self.client = motor.motor_asyncio.AsyncIOMotorClient(**self.kwargs)  # type: ignore
-        self.db = self.client[database]
+        self.db = self.client[self.database]
 
-    async def get_full_data(self, sync: Sync, size: int):
+    async def get_full_data(self, sync: Sync, size: int, start=None, end=None):
         collection = self.db[sync.table]
         if sync.fields:
             fields = {field: sync.fields[field] for field in sync.fields}
         else:
             fields = {}
-        cursor = collection.find({}, fields)
+        query = {}
+        if start is not None:
+            query["$gt"] = start
+        if end is not None:
+            query["$lte"] = end
+        if self.raw_bson:
+            # documents are decoded when they are converted for MeiliSearch
+            collection = collection.with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument)
+            )
+        cursor = collection.find(
+            {"_id": query} if query else {},
+            fields,
+            sort=[("_id", 1)],
+            batch_size=self.batch_size or size,
+        )
         ret = []
         async for doc in cursor:
-            doc["_id"] = str(doc["_id"])
+            if not self.raw_bson:
+                doc["_id"] = str(doc["_id"])
             ret.append(doc)
             if len(ret) == size:
                 yield ret
@@ -34,44 +72,144 @@ class Mongo(Source):
         if ret:
             yield ret
 
+    def dump_key(self, key: Any):
+        return str(key) if isinstance(key, ObjectId) else key
+
+    def load_key(self, key: Any):
+        # documents are returned with `_id` as string
+        return ObjectId(key) if isinstance(key, str) and ObjectId.is_valid(key) else key
+
+    async def get_ranges(self, sync: Sync):
+        if sync.parallel <= 1:
+            return to_ranges(None)
+        try:
+            # the same split points as chunk migration, read from the _id index without sampling
+            stats = await self.db.command("collStats", sync.table)
+            ret = await self.db.command(
+                "splitVector",
+                f"{self.database}.{sync.table}",
+                keyPattern={"_id": 1},
+                maxChunkSizeBytes=max(stats["size"] // sync.parallel, 1),
+            )
+            points = [key["_id"] for key in ret["splitKeys"]]
+        except OperationFailure:
+            # not allowed for the user or not supported, such as on Atlas
+            collection = self.db[sync.table]
+            pipeline = [{"$sample": {"size": sync.parallel * 100}}, {"$project": {"_id": 1}}]
+            points = [doc["_id"] async for doc in collection.aggregate(pipeline)]
+        return to_ranges(quantiles(points, sync.parallel))
+
     async def get_count(self, sync: Sync):
         collection = self.db[sync.table]
         return await collection.count_documents({})
 
+    async def get_existing_keys(self, sync: Sync, keys: List[Any]):
+        cursor = self.db[sync.table].find({"_id": {"$in": keys}}, {"_id": 1})
+        return {str(doc["_id"]) async for doc in cursor}
+
     async def ping(self):
         return await self.client.admin.command("ping")
 
+    def _watch(self, resume_token: Optional[dict] = None):
+        # only the synced collections and fields are sent by the server
+        pipeline: List[dict] = [
+            {
+                "$match": {
+                    "operationType": {"$in": ["insert", "update", "delete"]},
+                    "ns.coll": {"$in": self.tables},
+                }
+            }
+        ]
+        columns = [self.columns.get(table) for table in self.tables]
+        if all(columns):
+            fields = set().union(*columns)  # type: ignore
+            pipeline.append(
+                {
+                    "$project": {
+                        "operationType": 1,
+                        "ns": 1,
+                        "documentKey": 1,
+                        "clusterTime": 1,
+                        "updateDescription.updatedFields": 1,
+                        **{f"fullDocument.{field}": 1 for field in fields},
+                    }
+                }
+            )
+        return self.db.watch(
+            pipeline,
+            resume_after=resume_token,
+            batch_size=self.batch_size,
+            max_await_time_ms=self.max_await_time_ms,
+        )
+
     async def get_current_progress(self):
-        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "delete"]}}}]
-        async with self.db.watch(pipeline) as stream:
+        async with self._watch() as stream:
             return {"resume_token": stream.resume_token}
 
+    async def _lookup(self, changes: List[dict]):
+        ids: Dict[str, list] = {}
+        for change in changes:
+            if change["operationType"] == "update":
+                ids.setdefault(change["ns"]["coll"], []).append(change["documentKey"]["_id"])
+        documents = {}
+        for table, table_ids in ids.items():
+            columns = self.columns.get(table)
+            cursor = self.db[table].find(
+                {"_id": {"$in": table_ids}}, {column: 1 for column in columns} if columns else None
+            )
+            async for doc in cursor:
+                documents[(table, doc["_id"])] = doc
+        return documents
+
+    def _get_event(self, change: dict, documents: dict):
+        operation_type = change["operationType"]
+        table = change["ns"]["coll"]
+        key = change["documentKey"]["_id"]
+        if operation_type == "insert":
+            event_type = EventType.create
+            data = change["fullDocument"]
+        elif operation_type == "update":
+            event_type = EventType.update
+            if self.update_lookup:
+                data = documents.get((table, key))
+                if data is None:
+                    # deleted since, the delete follows in the stream
+                    return None
+            else:
+                data = change["updateDescription"]["updatedFields"]
+        elif operation_type == "delete":
+            event_type = EventType.delete
+            data = change["documentKey"]
+        data["_id"] = str(key)
+        return Event(
+            type=event_type,
+            table=table,
+            data=data,
+            progress=dict(resume_token=change["_id"]),
+            timestamp=change["clusterTime"].time if "clusterTime" in change else None,
+        )
+
     async def __aiter__(self):
-        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "delete"]}}}]
         if self.progress:
             resume_token = self.progress["resume_token"]
         else:
             resume_token = None
-        async with self.db.watch(pipeline, resume_after=resume_token) as stream:
+        async with self._watch(resume_token) as stream:
             async for change in stream:
-                resume_token = stream.resume_token
-                operation_type = change["operationType"]
-                if operation_type == "insert":
-                    event_type = EventType.create
-                    data = change["fullDocument"]
-                elif operation_type == "update":
-                    event_type = EventType.update
-                    data = change["updateDescription"]["updatedFields"]
-                elif operation_type == "delete":
-                    event_type = EventType.delete
-                    data = change["documentKey"]
-                data["_id"] = str(change["documentKey"]["_id"])
-                yield Event(
-                    type=event_type,
-                    table=change["ns"]["coll"],
-                    data=data,
-                    progress=dict(resume_token=resume_token),
-                )
+                changes = [change]
+                documents = {}
+                if self.update_lookup:
+                    # the changes already received are looked up together, one query per collection
+                    while len(changes) < (self.batch_size or 1000):
+                        change = await stream.try_next()
+                        if change is None:
+                            break
+                        changes.append(change)
+                    documents = await self._lookup(changes)
+                for change in changes:
+                    event = self._get_event(change, documents)
+                    if event:
+                        yield event
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.client.close()
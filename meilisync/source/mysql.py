@@ -1,8 +1,8 @@
 import asyncio
-from typing import List
+from typing import Any, List, Optional
 
 import asyncmy
-from asyncmy.cursors import DictCursor
+from asyncmy.cursors import DictCursor, SSDictCursor
 from asyncmy.errors import OperationalError
 from asyncmy.replication import BinLogStream
 from asyncmy.replication.row_events import (
@@ -12,10 +12,10 @@ from asyncmy.replication.row_events import (
 )
 from loguru import logger
 
-from meilisync.enums import EventType, SourceType
-from meilisync.schemas import Event, ProgressEvent
+from meilisync.enums import EventType, PaginationType, SourceType
+from meilisync.schemas import EventBatch, ProgressEvent
 from meilisync.settings import Sync
-from meilisync.source import Source
+from meilisync.source import Source, range_condition, split_range, to_ranges
 
 
 class MySQL(Source):
@@ -26,44 +26,140 @@ class MySQL(Source):
         progress: dict,
         tables: List[str],
         server_id: int = 1,
+        pool_size: int = 10,
+        net_write_timeout: int = 3600,
         **kwargs,
     ):
         super().__init__(progress, tables, **kwargs)
         self.server_id = int(server_id)
         self.database = kwargs.get("database")
+        self.pool_size = int(pool_size)
+        self.net_write_timeout = int(net_write_timeout)
+        self.pool: Optional[asyncmy.Pool] = None
+        self.pool_lock = asyncio.Lock()
 
-    async def get_full_data(self, sync: Sync, size: int):
-        conn = await asyncmy.connect(**self.kwargs)
+    async def get_pool(self) -> asyncmy.Pool:
+        # created lazily, the pool is bound to the event loop of the running command
+        async with self.pool_lock:
+            if not self.pool:
+                # pooled connections are reused, a transaction would keep returning old snapshots
+                self.pool = await asyncmy.create_pool(
+                    minsize=1, maxsize=self.pool_size, **{"autocommit": True, **self.kwargs}
+                )
+            return self.pool
+
+    async def get_full_data(self, sync: Sync, size: int, start=None, end=None):
         if sync.fields:
             fields = ", ".join(f"{field} as {sync.fields[field] or field}" for field in sync.fields)
         else:
             fields = "*"
-        async with conn.cursor(cursor=DictCursor) as cur:
-            offset = 0
-            while True:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            if sync.pagination == PaginationType.stream:
+                where, args = range_condition(sync.pk, start, end)
+                async for ret in self._stream(
+                    conn, f"SELECT {fields} FROM {sync.table} {where}ORDER BY {sync.pk}", args, size
+                ):
+                    yield ret
+                return
+            async with conn.cursor(cursor=DictCursor) as cur:
+                last, offset = start, 0
+                while True:
+                    where, args = range_condition(sync.pk, last, end)
+                    sql = (
+                        f"SELECT {fields} FROM {sync.table} {where}ORDER BY {sync.pk} LIMIT {size}"
+                    )
+                    if not sync.keyset:
+                        sql += f" OFFSET {offset}"
+                    await cur.execute(sql, args)
+                    ret = await cur.fetchall()
+                    if not ret:
+                        break
+                    yield ret
+                    if len(ret) < size:
+                        break
+                    if sync.keyset:
+                        last = ret[-1][sync.pk_field]
+                    else:
+                        offset += size
+
+    async def _stream(self, conn: asyncmy.Connection, sql: str, args: list, size: int):
+        # one scan with an unbuffered cursor, rows are fetched chunk by chunk, the server waits
+        # while a chunk is sent to MeiliSearch and aborts the scan after net_write_timeout
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT @@SESSION.net_write_timeout")
+            (timeout,) = await cur.fetchone()
+            await cur.execute(f"SET SESSION net_write_timeout = {self.net_write_timeout}")
+        cur = conn.cursor(cursor=SSDictCursor)
+        finished = False
+        try:
+            await cur.execute(sql, args)
+            while ret := await cur.fetchmany(size):
+                yield ret
+            finished = True
+        finally:
+            if finished:
+                await cur.close()
+                async with conn.cursor() as cur:
+                    await cur.execute(f"SET SESSION net_write_timeout = {timeout}")
+            else:
+                # closing the cursor would read the rest of the range, the connection is dropped
+                await conn.ensure_closed()
+
+    async def get_ranges(self, sync: Sync):
+        if sync.parallel <= 1 or not sync.keyset:
+            return to_ranges(None)
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
                 await cur.execute(
-                    f"SELECT {fields} FROM {sync.table} "
-                    f"ORDER BY {sync.pk} LIMIT {size} OFFSET {offset}"
+                    f"SELECT MIN({sync.pk}) AS min, MAX({sync.pk}) AS max FROM {sync.table}"
                 )
-                ret = await cur.fetchall()
-                if not ret:
-                    break
-                offset += size
-                yield ret
+                ret = await cur.fetchone()
+                if ret["min"] is None:
+                    return to_ranges(None)
+                points = split_range(ret["min"], ret["max"], sync.parallel)
+                if points is None:
+                    await cur.execute(f"SELECT COUNT(*) AS count FROM {sync.table}")
+                    count = (await cur.fetchone())["count"]
+                    points = []
+                    for i in range(1, sync.parallel):
+                        await cur.execute(
+                            f"SELECT {sync.pk} AS pk FROM {sync.table} ORDER BY {sync.pk} "
+                            f"LIMIT 1 OFFSET {count * i // sync.parallel}"
+                        )
+                        row = await cur.fetchone()
+                        if row:
+                            points.append(row["pk"])
+                return to_ranges(points)
 
     async def get_count(self, sync: Sync):
-        conn = await asyncmy.connect(**self.kwargs)
-        async with conn.cursor(cursor=DictCursor) as cur:
-            await cur.execute(f"SELECT COUNT(*) as count FROM {sync.table}")
-            ret = await cur.fetchone()
-            return ret["count"]
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
+                await cur.execute(f"SELECT COUNT(*) as count FROM {sync.table}")
+                ret = await cur.fetchone()
+                return ret["count"]
+
+    async def get_existing_keys(self, sync: Sync, keys: List[Any]):
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
+                await cur.execute(
+                    f"SELECT {sync.pk} AS pk FROM {sync.table} "
+                    f"WHERE {sync.pk} IN ({', '.join(['%s'] * len(keys))})",
+                    keys,
+                )
+                return {str(row["pk"]) for row in await cur.fetchall()}
 
     async def ping(self):
-        async with asyncmy.connect(**self.kwargs) as conn:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
             return await conn.ping()
 
     async def get_current_progress(self):
-        async with asyncmy.connect(**self.kwargs) as conn:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
             async with conn.cursor(cursor=DictCursor) as cur:
                 await cur.execute("SELECT VERSION()")
                 ret = await cur.fetchone()
@@ -107,22 +203,23 @@ class MySQL(Source):
                 async for event in self.stream:
                     if isinstance(event, WriteRowsEvent):
                         event_type = EventType.create
-                        data = event.rows[0]["values"]
+                        data = [row["values"] for row in event.rows]
                     elif isinstance(event, UpdateRowsEvent):
                         event_type = EventType.update
-                        data = event.rows[0]["after_values"]
+                        data = [row["after_values"] for row in event.rows]
                     elif isinstance(event, DeleteRowsEvent):
                         event_type = EventType.delete
-                        data = event.rows[0]["values"]
+                        data = [row["values"] for row in event.rows]
                     else:
                         continue
                     self.progress["master_log_file"] = self.stream._master_log_file
                     self.progress["master_log_position"] = self.stream._master_log_position
-                    yield Event(
+                    yield EventBatch(
                         type=event_type,
                         table=event.table,
                         data=data,
                         progress=self.progress,
+                        timestamp=event.timestamp,
                     )
             except OperationalError as e:
                 logger.exception(f"Binlog stream error: {e}, sleep 10s and retry...")
@@ -137,3 +234,6 @@ class MySQL(Source):
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.conn.close()
         self.ctl_conn.close()
+        if self.pool:
+            self.pool.close()
+            await self.pool.wait_closed()
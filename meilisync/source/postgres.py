@@ -1,174 +1,474 @@
 import asyncio
+import concurrent.futures
 import json
+import re
+import struct
 from asyncio import Queue
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlencode
 
+import asyncpg
 import psycopg2
 import psycopg2.errors
+from loguru import logger
 from psycopg2._psycopg import ReplicationMessage
 from psycopg2.extras import LogicalReplicationConnection
 
-from meilisync.enums import EventType, SourceType
+from meilisync.enums import EventType, PaginationType, SourceType
 from meilisync.schemas import Event, ProgressEvent
 from meilisync.settings import Sync
-from meilisync.source import Source
+from meilisync.source import Source, quantiles, range_condition, split_range, to_ranges
 
+# 2000-01-01 in unix time, pgoutput timestamps count microseconds from it
+PG_EPOCH = 946684800
+# seconds between standby status updates sent to the server
+STATUS_INTERVAL = 1
+EVENT_TYPES = {
+    "I": EventType.create,
+    "U": EventType.update,
+    "D": EventType.delete,
+}
+PGOUTPUT_TYPES: Dict[int, Callable[[str], Any]] = {
+    16: lambda value: value == "t",
+    20: int,
+    21: int,
+    23: int,
+    26: int,
+    700: float,
+    701: float,
+    1700: float,
+    114: json.loads,
+    3802: json.loads,
+}
+
+
+class PgOutputReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def read(self, fmt: str):
+        ret = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return ret[0] if len(ret) == 1 else ret
+
+    def read_char(self):
+        self.offset += 1
+        return chr(self.data[self.offset - 1])
+
+    def read_string(self):
+        end = self.data.index(b"\0", self.offset)
+        ret = self.data[self.offset : end].decode()
+        self.offset = end + 1
+        return ret
+
+    def read_tuple(self, columns: List[Tuple[str, int]], wanted: Optional[Set[str]] = None):
+        values: Dict[str, Any] = {}
+        for i in range(self.read("!h")):
+            kind = self.read_char()
+            name, type_oid = columns[i]
+            skip = wanted is not None and name not in wanted
+            if kind == "n" and not skip:
+                values[name] = None
+            elif kind == "t":
+                length = self.read("!i")
+                self.offset += length
+                if skip:
+                    continue
+                value = self.data[self.offset - length : self.offset].decode()
+                convert = PGOUTPUT_TYPES.get(type_oid)
+                values[name] = convert(value) if convert else value
+            # "u" is an unchanged TOASTed value, which pgoutput doesn't send
+        return values
 
-class CustomDictRow(psycopg2.extras.RealDictRow):
-    def __getitem__(self, key):
-        try:
-            return super().__getitem__(key)
-        except KeyError as exc:
-            if isinstance(key, int):
-                return super().__getitem__(list(self.keys())[key])
-            raise exc
 
+def lsn_to_str(lsn: int):
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
 
-class CustomDictCursor(psycopg2.extras.RealDictCursor):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        kwargs["row_factory"] = CustomDictRow
-        self.row_factory = CustomDictRow
+
+def connect_kwargs(kwargs: dict) -> Dict[str, Any]:
+    """
+    Translate the libpq parameters given to psycopg2 into asyncpg ones, the connection and ssl
+    parameters go through a DSN, which asyncpg parses like libpq does.
+    """
+    kwargs = {key: value for key, value in kwargs.items() if value is not None}
+    ret: Dict[str, Any] = {}
+    if "connect_timeout" in kwargs:
+        ret["timeout"] = float(kwargs.pop("connect_timeout"))
+    server_settings = {}
+    # e.g. "-c search_path=app -c statement_timeout=0" or "--search_path=app"
+    for key, value in re.findall(r"(?:-c\s*|--)([\w.-]+)=(\S+)", kwargs.pop("options", "")):
+        server_settings[key.replace("-", "_")] = value
+    if "application_name" in kwargs:
+        server_settings["application_name"] = kwargs.pop("application_name")
+    if server_settings:
+        ret["server_settings"] = server_settings
+    ret["dsn"] = "postgresql://?" + urlencode(kwargs)
+    return ret
 
 
 class Postgres(Source):
     type = SourceType.postgres
     slot = "meilisync"
+    batch_size = 1000
 
     def __init__(
         self,
         progress: dict,
         tables: List[str],
+        queue_size: int = 10000,
+        format_version: int = 1,
+        output_plugin: str = "wal2json",
+        publication: str = "meilisync",
+        pool_size: int = 10,
         **kwargs,
     ):
         super().__init__(progress, tables, **kwargs)
+        self.pool_size = int(pool_size)
+        self.pool: Optional[asyncpg.Pool] = None
+        self.pool_lock = asyncio.Lock()
+        self.format_version = int(format_version)
+        self.output_plugin = output_plugin
+        self.publication = publication
+        self.relations: Dict[int, Tuple[str, List[Tuple[str, int]]]] = {}
         self.conn = psycopg2.connect(**self.kwargs, connection_factory=LogicalReplicationConnection)
         self.cursor = self.conn.cursor()
-        self.queue = None
+        self.queue_size = int(queue_size)
+        self.queue: Optional[Queue] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         if self.progress:
             self.start_lsn = self.progress["start_lsn"]
         else:
             self.cursor.execute("SELECT pg_current_wal_lsn()")
             self.start_lsn = self.cursor.fetchone()[0]
-        self.conn_dict = psycopg2.connect(**self.kwargs, cursor_factory=CustomDictCursor)
+        self.committed_progress = {"start_lsn": self.start_lsn}
+        self.pending: List[ProgressEvent] = []
+        # the transaction changed a synced table, pending may be flushed already
+        self.changed = False
+        self.commit_timestamp: Optional[float] = None
 
-    async def get_current_progress(self):
-        sql = "SELECT pg_current_wal_lsn()"
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection):
+        # json as objects and uuids as strings, the same as the replication changes
+        for type_ in ("json", "jsonb"):
+            await conn.set_type_codec(
+                type_, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+            )
+        await conn.set_type_codec("uuid", encoder=str, decoder=str, schema="pg_catalog")
 
-        def _():
-            with self.conn.cursor() as cur:
-                cur.execute(sql)
-                ret = cur.fetchone()
-                return ret[0]
+    async def get_pool(self) -> asyncpg.Pool:
+        # created lazily, the pool is bound to the event loop of the running command
+        async with self.pool_lock:
+            if not self.pool:
+                self.pool = await asyncpg.create_pool(
+                    **connect_kwargs(self.kwargs),
+                    min_size=1,
+                    max_size=self.pool_size,
+                    init=self._init_connection,
+                )
+            return self.pool
+
+    async def get_current_progress(self):
+        pool = await self.get_pool()
+        return {"start_lsn": await pool.fetchval("SELECT pg_current_wal_lsn()::text")}
 
-        start_lsn = await asyncio.get_event_loop().run_in_executor(None, _)
-        return {"start_lsn": start_lsn}
+    def set_progress(self, progress: dict):
+        super().set_progress(progress)
+        self.start_lsn = progress["start_lsn"]
+        self.committed_progress = {"start_lsn": self.start_lsn}
 
-    async def get_full_data(self, sync: Sync, size: int):
+    async def get_full_data(self, sync: Sync, size: int, start=None, end=None):
         if sync.fields:
             fields = ", ".join(f"{field} as {sync.fields[field] or field}" for field in sync.fields)
         else:
             fields = "*"
-        offset = 0
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            if sync.pagination == PaginationType.stream:
+                # one scan with a server side cursor, rows are fetched chunk by chunk
+                where, args = range_condition(sync.pk, start, end, numbered=True)
+                async with conn.transaction():
+                    cur = await conn.cursor(
+                        f"SELECT {fields} FROM {sync.table} {where}ORDER BY {sync.pk}", *args
+                    )
+                    while ret := await cur.fetch(size):
+                        yield [dict(row) for row in ret]
+                return
+            last, offset = start, 0
+            while True:
+                where, args = range_condition(sync.pk, last, end, numbered=True)
+                sql = f"SELECT {fields} FROM {sync.table} {where}ORDER BY {sync.pk} LIMIT {size}"
+                if not sync.keyset:
+                    sql += f" OFFSET {offset}"
+                ret = [dict(row) for row in await conn.fetch(sql, *args)]
+                if not ret:
+                    break
+                yield ret
+                if len(ret) < size:
+                    break
+                if sync.keyset:
+                    last = ret[-1][sync.pk_field]
+                else:
+                    offset += size
 
-        def _():
-            with self.conn_dict.cursor() as cur:
-                cur.execute(
-                    f"SELECT {fields} FROM {sync.table} ORDER BY "
-                    f"{sync.pk} LIMIT {size} OFFSET {offset}"
-                )
-                return cur.fetchall()
+    async def get_ranges(self, sync: Sync):
+        if sync.parallel <= 1 or not sync.keyset:
+            return to_ranges(None)
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            ret = await conn.fetchrow(
+                f"SELECT MIN({sync.pk}) AS min, MAX({sync.pk}) AS max FROM {sync.table}"
+            )
+            if ret["min"] is None:
+                return to_ranges(None)
+            points = split_range(ret["min"], ret["max"], sync.parallel)
+            if points is not None:
+                return to_ranges(points)
+            reltuples = await conn.fetchval(
+                "SELECT reltuples FROM pg_class WHERE oid = $1::regclass", sync.table
+            )
+            if reltuples <= 0:
+                # never analyzed, the split points are probed in primary key order instead of
+                # sampling the whole table
+                count = await conn.fetchval(f"SELECT COUNT(*) FROM {sync.table}")
+                points = [
+                    await conn.fetchval(
+                        f"SELECT {sync.pk} FROM {sync.table} ORDER BY {sync.pk} LIMIT 1 OFFSET $1",
+                        count * i // sync.parallel,
+                    )
+                    for i in range(1, sync.parallel)
+                ]
+                return to_ranges([point for point in points if point is not None])
+            percent = min(100.0, 100.0 * sync.parallel * 100 / reltuples)
+            rows = await conn.fetch(
+                f"SELECT {sync.pk} AS pk FROM {sync.table} TABLESAMPLE SYSTEM ($1)", percent
+            )
+            return to_ranges(quantiles([row["pk"] for row in rows], sync.parallel))
+
+    async def _put(self, events: Sequence[ProgressEvent]):
+        for event in events:
+            await self.queue.put(event)  # type: ignore
 
+    def _put_threadsafe(self, events: Sequence[ProgressEvent]):
+        # blocks this replication thread while the queue is full, status updates are still sent
+        # so the server doesn't drop the connection after wal_sender_timeout
+        future = asyncio.run_coroutine_threadsafe(self._put(events), self.loop)  # type: ignore
         while True:
-            ret = await asyncio.get_event_loop().run_in_executor(None, _)
-            if not ret:
-                break
-            offset += size
-            yield ret
+            try:
+                return future.result(timeout=STATUS_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                self.cursor.send_feedback()
 
     def _consumer(self, msg: ReplicationMessage):
         payload = json.loads(msg.payload)
         changes = payload.get("change")
         if not changes:
             return
+        events = []
+        progress = {"start_lsn": payload.get("nextlsn")}
         for change in changes:
             kind = change.get("kind")
             table = change.get("table")
             if table not in self.tables:
-                return
-            columnnames = change.get("columnnames", [])
-            columnvalues = change.get("columnvalues", [])
-            columntypes = change.get("columntypes", [])
-
-            for i in range(len(columntypes)):
-                if columntypes[i] == "json":
-                    columnvalues[i] = json.loads(columnvalues[i])
+                continue
+            columns = self.columns.get(table)
+            values = {}
+            for name, value, type_ in zip(
+                change.get("columnnames", []),
+                change.get("columnvalues", []),
+                change.get("columntypes", []),
+            ):
+                if columns is not None and name not in columns:
+                    continue
+                if type_ == "json":
+                    value = json.loads(value)
+                values[name] = value
 
             if kind == "update":
-                values = dict(zip(columnnames, columnvalues))
                 event_type = EventType.update
             elif kind == "delete":
-                values = (
-                    dict(zip(columnnames, columnvalues))
-                    if columnvalues
-                    else {change["oldkeys"]["keynames"][0]: change["oldkeys"]["keyvalues"][0]}
-                )
+                if not values:
+                    values = {change["oldkeys"]["keynames"][0]: change["oldkeys"]["keyvalues"][0]}
                 event_type = EventType.delete
             elif kind == "insert":
-                values = dict(zip(columnnames, columnvalues))
                 event_type = EventType.create
             else:
-                return
-            asyncio.new_event_loop().run_until_complete(
-                self.queue.put(  # type: ignore
-                    Event(
-                        type=event_type,
-                        table=table,
-                        data=values,
-                        progress={"start_lsn": payload.get("nextlsn")},
-                    )
+                continue
+            events.append(
+                Event(
+                    type=event_type,
+                    table=table,
+                    data=values,
+                    progress=progress,
                 )
             )
+        if events:
+            self._put_threadsafe(events)
+
+    def _flush_pending(self):
+        events, self.pending = self.pending, []
+        self._put_threadsafe(events)
+
+    def _add_pending(self, event_type: EventType, table: str, values: dict):
+        # changes keep the last committed position, progress only moves on at commit
+        self.pending.append(
+            Event(
+                type=event_type,
+                table=table,
+                data=values,
+                progress=self.committed_progress,
+                timestamp=self.commit_timestamp,
+            )
+        )
+        self.changed = True
+        if len(self.pending) >= self.batch_size:
+            self._flush_pending()
+
+    def _commit_pending(self, lsn: str):
+        if self.changed:
+            self.changed = False
+            self.committed_progress = {"start_lsn": lsn}
+            self.pending.append(ProgressEvent(progress=self.committed_progress))
+            self._flush_pending()
+
+    def _consumer_v2(self, msg: ReplicationMessage):
+        payload = json.loads(msg.payload)
+        action = payload.get("action")
+        if action == "C":
+            self._commit_pending(payload.get("nextlsn") or lsn_to_str(msg.data_start))
+            return
+        table = payload.get("table")
+        if action not in ("I", "U", "D") or table not in self.tables:
+            return
+        columns = self.columns.get(table)
+        values = {}
+        for column in payload.get("columns") or payload.get("identity") or []:
+            if columns is not None and column["name"] not in columns:
+                continue
+            value = column["value"]
+            if column["type"] == "json" and isinstance(value, str):
+                value = json.loads(value)
+            values[column["name"]] = value
+        self._add_pending(EVENT_TYPES[action], table, values)
+
+    def _consumer_pgoutput(self, msg: ReplicationMessage):
+        reader = PgOutputReader(msg.payload)
+        kind = reader.read_char()
+        if kind == "R":
+            relation_id = reader.read("!I")
+            reader.read_string()
+            table = reader.read_string()
+            reader.read("!b")
+            columns = []
+            for _ in range(reader.read("!h")):
+                reader.read("!b")
+                name = reader.read_string()
+                columns.append((name, reader.read("!Ii")[0]))
+            self.relations[relation_id] = table, columns
+        elif kind == "B":
+            _, timestamp, _ = reader.read("!QqI")
+            self.commit_timestamp = PG_EPOCH + timestamp / 1_000_000
+        elif kind == "C":
+            _, _, end_lsn, _ = reader.read("!bQQq")
+            self._commit_pending(lsn_to_str(end_lsn))
+        elif kind in EVENT_TYPES:
+            table, columns = self.relations[reader.read("!I")]
+            if table not in self.tables:
+                return
+            tuple_kind = reader.read_char()
+            if kind == "U" and tuple_kind in ("K", "O"):
+                reader.read_tuple(columns)
+                tuple_kind = reader.read_char()
+            self._add_pending(
+                EVENT_TYPES[kind], table, reader.read_tuple(columns, self.columns.get(table))
+            )
 
     async def get_count(self, sync: Sync):
-        with self.conn_dict.cursor() as cur:
-            cur.execute(f"SELECT COUNT(*) FROM {sync.table}")
-            ret = cur.fetchone()
-            return ret[0]
+        pool = await self.get_pool()
+        return await pool.fetchval(f"SELECT COUNT(*) FROM {sync.table}")
+
+    async def get_existing_keys(self, sync: Sync, keys: List[Any]):
+        pool = await self.get_pool()
+        rows = await pool.fetch(
+            f"SELECT {sync.pk} AS pk FROM {sync.table} WHERE {sync.pk} = ANY($1)", keys
+        )
+        return {str(row["pk"]) for row in rows}
 
     async def __aiter__(self):
-        self.queue = Queue()
+        self.loop = asyncio.get_running_loop()
+        self.queue = Queue(maxsize=self.queue_size)
         try:
-            self.cursor.create_replication_slot(self.slot, output_plugin="wal2json")
+            self.cursor.create_replication_slot(self.slot, output_plugin=self.output_plugin)
         except psycopg2.errors.DuplicateObject:  # type: ignore
             pass
+        if self.output_plugin == "pgoutput":
+            await self._create_publication()
+            options = {"proto_version": "1", "publication_names": self.publication}
+            consumer = self._consumer_pgoutput
+        elif self.format_version == 2:
+            options = {"include-lsn": "true", "format-version": "2"}
+            consumer = self._consumer_v2
+        else:
+            options = {"include-lsn": "true"}
+            consumer = self._consumer
         self.cursor.start_replication(
             slot_name=self.slot,
-            decode=True,
-            status_interval=1,
+            decode=self.output_plugin != "pgoutput",
+            status_interval=STATUS_INTERVAL,
             start_lsn=self.start_lsn,
-            options={
-                "include-lsn": "true",
-            },
-        )
-        asyncio.ensure_future(
-            asyncio.get_event_loop().run_in_executor(
-                None, self.cursor.consume_stream, self._consumer
-            )
+            options=options,
         )
+        stream = self.loop.run_in_executor(None, self.cursor.consume_stream, consumer)
         yield ProgressEvent(
             progress={"start_lsn": self.start_lsn},
         )
-        while True:
-            yield await self.queue.get()
+        get = None
+        try:
+            while True:
+                if not self.queue.empty():
+                    yield self.queue.get_nowait()
+                    continue
+                if stream.done():
+                    # the replication stream only returns on error, raise it instead of waiting
+                    stream.result()
+                    raise RuntimeError("Replication stream stopped")
+                get = asyncio.ensure_future(self.queue.get())
+                await asyncio.wait({get, stream}, return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield get.result()
+                else:
+                    get.cancel()
+        finally:
+            if get:
+                get.cancel()
 
-    def _ping(self):
-        with self.conn_dict.cursor() as cur:
-            cur.execute("SELECT 1")
+    async def _create_publication(self):
+        pool = await self.get_pool()
+        try:
+            await pool.execute(
+                f"CREATE PUBLICATION {self.publication} FOR TABLE {', '.join(self.tables)}"
+            )
+        except asyncpg.DuplicateObjectError:
+            # tables synced since it was created are added, otherwise their changes never arrive
+            rows = await pool.fetch(
+                "SELECT schemaname, tablename FROM pg_publication_tables WHERE pubname = $1",
+                self.publication,
+            )
+            published = {row["tablename"] for row in rows}
+            published.update(f"{row['schemaname']}.{row['tablename']}" for row in rows)
+            missing = [table for table in self.tables if table not in published]
+            if missing:
+                logger.info(f"Add tables {missing} to publication {self.publication}")
+                await pool.execute(
+                    f"ALTER PUBLICATION {self.publication} ADD TABLE {', '.join(missing)}"
+                )
 
     async def ping(self):
-        await asyncio.get_event_loop().run_in_executor(None, self._ping)
+        pool = await self.get_pool()
+        await pool.execute("SELECT 1")
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.cursor.close()
         self.conn.close()
+        if self.pool:
+            await self.pool.close()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import pickle
+import struct
+from collections import deque
+from typing import AsyncIterator, BinaryIO, Deque, Optional
+
+from meilisync.progress import Checkpointer
+from meilisync.progress.file import File
+from meilisync.schemas import ProgressEvent
+
+HEADER = struct.Struct("!I")
+
+
+class Spool:
+    """
+    Append-only spool of source events in segment files, the source fills it at full speed while
+    the sync loop drains it at its own pace.
+    """
+
+    def __init__(
+        self,
+        path: str = "spool",
+        segment_size: int = 64 * 1024 * 1024,
+        max_size: Optional[int] = None,
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+        # spooled events are not applied yet, the source resumes from the applied progress,
+        # only the spool's own files are removed, the directory may hold anything else
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".spool") or name in ("read.json", "read.json.tmp"):
+                os.remove(os.path.join(path, name))
+        self.checkpointer = Checkpointer(File(os.path.join(path, "read.json")))
+        self._segments: Deque[int] = deque()
+        self._writer: Optional[BinaryIO] = None
+        self._write_size = 0
+        self._size = 0
+        self._error: Optional[BaseException] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._filler: Optional[asyncio.Task] = None
+        self._roll()
+
+    @property
+    def size(self):
+        return self._size
+
+    def _segment(self, segment: int):
+        return os.path.join(self.path, f"{segment:010d}.spool")
+
+    def _roll(self):
+        if self._writer:
+            self._writer.close()
+        segment = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(segment)
+        self._writer = open(self._segment(segment), "wb")
+        self._write_size = 0
+
+    async def put(self, event: ProgressEvent):
+        # the segment being written is always kept, so at least one segment fits
+        while self.max_size and self._size >= self.max_size and len(self._segments) > 1:
+            self._writable.clear()
+            await self._writable.wait()
+        data = pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+        self._writer.write(HEADER.pack(len(data)) + data)  # type: ignore
+        self._writer.flush()  # type: ignore
+        self._write_size += HEADER.size + len(data)
+        self._size += HEADER.size + len(data)
+        if self._write_size >= self.segment_size:
+            self._roll()
+        self._readable.set()
+        if event.progress:
+            await self.checkpointer.set(**event.progress)
+
+    def start(self, events: AsyncIterator[ProgressEvent]):
+        self._filler = asyncio.ensure_future(self._fill(events))
+
+    async def _fill(self, events: AsyncIterator[ProgressEvent]):
+        try:
+            async for event in events:
+                await self.put(event)
+        except Exception as e:
+            # raised to the sync loop once the spool is drained
+            self._error = e
+            self._readable.set()
+        finally:
+            await self.checkpointer.flush()
+
+    async def _wait(self):
+        if self._error:
+            raise RuntimeError("Source stopped") from self._error
+        self._readable.clear()
+        await self._readable.wait()
+
+    async def __aiter__(self):
+        while True:
+            segment = self._segments[0]
+            with open(self._segment(segment), "rb") as reader:
+                while True:
+                    pos = reader.tell()
+                    header = reader.read(HEADER.size)
+                    if len(header) == HEADER.size:
+                        (length,) = HEADER.unpack(header)
+                        data = reader.read(length)
+                        if len(data) == length:
+                            yield pickle.loads(data)
+                            continue
+                    reader.seek(pos)
+                    if segment != self._segments[-1] and not header:
+                        break
+                    await self._wait()
+            self._segments.popleft()
+            self._size -= os.path.getsize(self._segment(segment))
+            os.remove(self._segment(segment))
+            self._writable.set()
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from conftest import MemorySource
+from meilisync.checksum import Checksum
+from meilisync.settings import Sync
+
+
+class MemoryIndex:
+    def __init__(self, docs):
+        self.docs = docs
+        self.deleted: list = []
+
+    async def get_documents(self, ids=None, offset=0, limit=20, fields=None):
+        docs = [doc for doc in self.docs if ids is None or str(doc["id"]) in ids]
+        docs = [{k: v for k, v in doc.items() if not fields or k in fields} for doc in docs]
+        return SimpleNamespace(results=docs[offset : offset + limit])
+
+    async def delete_documents(self, ids):
+        self.deleted.extend(ids)
+
+
+class MemoryMeili:
+    def __init__(self, index: MemoryIndex):
+        self.index = index
+        self.client = SimpleNamespace(index=lambda name: index)
+        self.added: list = []
+
+    async def add_data(self, sync: Sync, data: list):
+        self.added.extend(data)
+
+    async def get_count(self, index: str):
+        return len(self.index.docs)
+
+
+async def test_checksum_repair():
+    index = MemoryIndex(
+        [
+            {"id": 1, "name": "name1"},
+            {"id": 2, "name": "stale"},
+            {"id": 4, "name": "name4"},
+            {"id": 5, "name": "name5"},
+            {"id": 6, "name": "name6"},
+        ]
+    )
+    meili = MemoryMeili(index)
+    source = MemorySource([{"id": i, "name": f"name{i}"} for i in range(1, 6)])
+    checksum = Checksum(source, meili, Sync(table="test"), 2)  # type: ignore
+    result = await checksum.run(repair=True)
+    assert (result.chunks, result.mismatched_chunks) == (3, 2)
+    assert (result.different, result.missing, result.extra) == (1, 1, 1)
+    assert [row["id"] for row in meili.added] == [2, 3]
+    assert index.deleted == ["6"]
@@ -0,0 +1,38 @@
+from meilisync.enums import EventType
+from meilisync.event import EventCollection
+from meilisync.schemas import Event, EventBatch
+from meilisync.settings import Sync
+
+sync = Sync(table="test")
+
+
+def test_merge_events():
+    collection = EventCollection()
+    collection.add_event(sync, Event(type=EventType.create, data={"id": 1, "age": 18}))
+    collection.add_event(sync, Event(type=EventType.update, data={"id": 1, "age": 19}))
+    collection.add_event(sync, Event(type=EventType.update, data={"id": 1, "name": "test"}))
+    collection.add_event(sync, Event(type=EventType.create, data={"id": 2, "age": 18}))
+    collection.add_event(sync, Event(type=EventType.delete, data={"id": 2}))
+    collection.add_events(
+        sync,
+        EventBatch(type=EventType.update, data=[{"id": 3, "age": 20}, {"id": 4, "age": 21}]),
+    )
+    collection.add_event(sync, Event(type=EventType.delete, data={"id": 4}))
+    assert collection.size == 4
+
+    created_events, updated_events, deleted_events = collection.pop_events
+    assert created_events[sync] == [{"id": 1, "age": 19, "name": "test"}]
+    assert updated_events[sync] == [{"id": 3, "age": 20}]
+    assert deleted_events[sync] == [{"id": 2}, {"id": 4}]
+    assert collection.size == 0
+
+
+def test_delete_create_delete():
+    collection = EventCollection()
+    collection.add_event(sync, Event(type=EventType.delete, data={"id": 1}))
+    collection.add_event(sync, Event(type=EventType.create, data={"id": 1, "age": 18}))
+    collection.add_event(sync, Event(type=EventType.delete, data={"id": 1}))
+    assert collection.size == 1
+    created_events, updated_events, deleted_events = collection.pop_events
+    assert not created_events[sync] and not updated_events[sync]
+    assert deleted_events[sync] == [{"id": 1}]
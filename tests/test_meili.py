@@ -0,0 +1,129 @@
+import asyncio
+import gzip
+import json
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from meilisearch_python_sdk.models.task import TaskResult
+
+from meilisync.enums import CompressionType
+from meilisync.meili import InsertSizeController, TaskTracker, ndjson_body
+from meilisync.settings import AdaptiveInsert
+
+
+def _task(seconds: float):
+    now = datetime.now()
+    return TaskResult.model_validate(
+        dict(
+            uid=1,
+            status="succeeded",
+            type="documentAdditionOrUpdate",
+            enqueuedAt=now,
+            finishedAt=now + timedelta(seconds=seconds),
+        )
+    )
+
+
+def test_insert_size_controller():
+    controller = InsertSizeController(AdaptiveInsert(min_size=100, max_size=1000))
+    controller.observe_tasks([_task(3)], 0)
+    assert controller.insert_size == 200
+    controller.observe_tasks([_task(0.1)], 20)
+    assert controller.insert_size == 400
+    controller.observe_tasks([_task(0.1)], 0)
+    assert controller.insert_size == 300
+    controller.observe_lag(120)
+    assert controller.insert_size == 1000
+    controller.observe_lag(1)
+    assert controller.insert_size == 300
+
+
+async def _read(body):
+    return b"".join([chunk async for chunk in body])
+
+
+async def test_ndjson_body():
+    docs = [{"id": i, "name": "test"} for i in range(10000)]
+    raw = await _read(ndjson_body(docs))
+    assert [json.loads(line) for line in raw.splitlines()] == docs
+    assert gzip.decompress(await _read(ndjson_body(docs, CompressionType.gzip))) == raw
+    assert zlib.decompress(await _read(ndjson_body(docs, CompressionType.deflate))) == raw
+
+
+class TaskClient:
+    def __init__(self):
+        self.statuses = {}
+
+    async def get_tasks(self, uids, statuses, limit):
+        return SimpleNamespace(
+            results=[
+                SimpleNamespace(uid=uid, status=self.statuses[uid], error=None)
+                for uid in uids
+                if self.statuses.get(uid) in statuses
+            ]
+        )
+
+
+def _tracker(client: TaskClient):
+    committed: list = []
+
+    async def on_commit(value):
+        committed.append(value)
+
+    return TaskTracker(client, on_commit, interval=0), committed  # type: ignore
+
+
+async def test_task_tracker_commit_in_order():
+    client = TaskClient()
+    tracker, committed = _tracker(client)
+    tracker.add([SimpleNamespace(task_uid=1)], "a")  # type: ignore
+    tracker.add([SimpleNamespace(task_uid=2)], "b")  # type: ignore
+    client.statuses[2] = "succeeded"
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert committed == []
+    client.statuses[1] = "succeeded"
+    await tracker.join()
+    assert committed == ["b"]
+
+
+async def test_task_tracker_failed_task():
+    client = TaskClient()
+    tracker, committed = _tracker(client)
+    client.statuses = {1: "succeeded", 2: "failed", 3: "succeeded"}
+    for uid, value in ((1, "a"), (2, "b"), (3, "c")):
+        tracker.add([SimpleNamespace(task_uid=uid)], value)  # type: ignore
+    with pytest.raises(RuntimeError):
+        await tracker.join()
+    assert committed == ["a"]
+    with pytest.raises(RuntimeError):
+        tracker.add([], "d")
+
+
+async def test_task_tracker_failed_batch():
+    client = TaskClient()
+    tracker, committed = _tracker(client)
+    client.statuses[1] = "succeeded"
+    tracker.add([SimpleNamespace(task_uid=1)], "a")  # type: ignore
+    tracker.fail(ConnectionError())
+    with pytest.raises(ConnectionError):
+        tracker.add([], "b")
+    with pytest.raises(ConnectionError):
+        await tracker.join()
+    assert "b" not in committed
+
+
+async def test_task_tracker_poll_error():
+    client = TaskClient()
+    tracker, committed = _tracker(client)
+
+    async def get_tasks(**kwargs):
+        raise TypeError("unexpected keyword argument")
+
+    client.get_tasks = get_tasks  # type: ignore
+    tracker.add([SimpleNamespace(task_uid=1)], "a")  # type: ignore
+    with pytest.raises(TypeError):
+        await tracker.join()
+    assert committed == []
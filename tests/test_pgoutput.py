@@ -0,0 +1,81 @@
+import json
+import struct
+from types import SimpleNamespace
+
+from meilisync.enums import EventType
+from meilisync.schemas import Event
+from meilisync.source.postgres import PgOutputReader, Postgres
+
+
+def _tuple(*values):
+    data = struct.pack("!h", len(values))
+    for value in values:
+        if value is None:
+            data += b"n"
+        else:
+            data += b"t" + struct.pack("!i", len(value)) + value
+    return data
+
+
+def test_read_relation_and_tuple():
+    data = (
+        b"R"
+        + struct.pack("!I", 16384)
+        + b"public\0test\0"
+        + struct.pack("!bh", 100, 3)
+        + b"\x01id\0"
+        + struct.pack("!Ii", 23, -1)
+        + b"\x00data_json\0"
+        + struct.pack("!Ii", 114, -1)
+        + b"\x00name\0"
+        + struct.pack("!Ii", 25, -1)
+    )
+    reader = PgOutputReader(data)
+    assert reader.read_char() == "R"
+    assert reader.read("!I") == 16384
+    assert reader.read_string() == "public"
+    assert reader.read_string() == "test"
+    reader.read("!bh")
+
+    columns = [("id", 23), ("data_json", 114), ("name", 25)]
+    reader = PgOutputReader(_tuple(b"1", b'{"name": "test data"}', None))
+    assert reader.read_tuple(columns) == {
+        "id": 1,
+        "data_json": {"name": "test data"},
+        "name": None,
+    }
+
+
+def _source(batch_size: int):
+    source = Postgres.__new__(Postgres)
+    source.tables = ["test"]
+    source.columns = {}
+    source.batch_size = batch_size
+    source.pending = []
+    source.changed = False
+    source.commit_timestamp = None
+    source.committed_progress = {"start_lsn": "0/1"}
+    events: list = []
+    source._put_threadsafe = events.extend  # type: ignore
+    return source, events
+
+
+def _message(**payload):
+    return SimpleNamespace(payload=json.dumps(payload), data_start=0)
+
+
+def test_consumer_v2_commit_after_full_batch():
+    source, events = _source(batch_size=2)
+    for i in (1, 2):
+        column = {"name": "id", "type": "integer", "value": i}
+        source._consumer_v2(_message(action="I", table="test", columns=[column]))
+    source._consumer_v2(_message(action="C", nextlsn="0/2"))
+    source._consumer_v2(_message(action="C", nextlsn="0/3"))
+    assert [event.data for event in events if isinstance(event, Event)] == [{"id": 1}, {"id": 2}]
+    assert all(event.type == EventType.create for event in events if isinstance(event, Event))
+    assert [event.progress for event in events] == [
+        {"start_lsn": "0/1"},
+        {"start_lsn": "0/1"},
+        {"start_lsn": "0/2"},
+    ]
+    assert source.committed_progress == {"start_lsn": "0/2"}
@@ -0,0 +1,17 @@
+import asyncio
+
+from conftest import MemoryProgress
+from meilisync.progress import Checkpointer
+
+
+async def test_checkpointer():
+    progress = MemoryProgress()
+    checkpointer = Checkpointer(progress, interval=50, size=3)
+    for i in range(5):
+        await checkpointer.set(pos=i)
+    assert progress.writes == [{"pos": 2}]
+    await asyncio.sleep(0.1)
+    assert progress.writes == [{"pos": 2}, {"pos": 4}]
+    await checkpointer.set(pos=5)
+    await checkpointer.flush()
+    assert progress.writes[-1] == {"pos": 5}
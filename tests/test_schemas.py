@@ -0,0 +1,57 @@
+import datetime
+import decimal
+import uuid
+
+from meilisync.schemas import DECODERS, Transformer, register_decoder
+
+
+def test_transformer_projection():
+    transformer = Transformer({"id": None, "name": "title"})
+    rows = [{"id": 1, "name": "a", "age": 2}]
+    assert transformer(rows) == [{"id": 1, "title": "a"}]
+    # full data rows are already renamed by the query
+    assert transformer([{"id": 1, "title": "a"}]) == [{"id": 1, "title": "a"}]
+    assert list(transformer.iter(rows)) == [{"id": 1, "title": "a"}]
+
+
+def test_transformer_fallback():
+    # rows without any mapped field, such as a delete with only the key, are kept as they are
+    transformer = Transformer({"id": "uid"})
+    assert transformer([{"pk": 1, "amount": decimal.Decimal("1.5")}]) == [{"pk": 1, "amount": 1.5}]
+    assert Transformer()([{"id": 1, "name": "a"}]) == [{"id": 1, "name": "a"}]
+
+
+def test_transformer_converters():
+    now = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    value = uuid.uuid4()
+    row = {
+        "datetime": now,
+        "date": now.date(),
+        "decimal": decimal.Decimal("1.25"),
+        "bytes": b"a\xff",
+        "uuid": value,
+    }
+    expected = {
+        "datetime": int(now.timestamp()),
+        "date": "2024-01-02",
+        "decimal": 1.25,
+        "bytes": "a\ufffd",
+        "uuid": str(value),
+    }
+    assert Transformer()([row]) == [expected]
+    assert Transformer({key: None for key in row})([row]) == [expected]
+
+
+class RawRow:
+    def __init__(self, data: dict):
+        self.data = data
+
+
+def test_transformer_decoder():
+    register_decoder(RawRow, lambda row: row.data)
+    try:
+        row = RawRow({"id": 1, "tags": [{"a": 1}], "price": decimal.Decimal("2.5")})
+        assert Transformer()([row]) == [{"id": 1, "tags": [{"a": 1}], "price": 2.5}]  # type: ignore
+        assert Transformer({"id": None})([row]) == [{"id": 1}]  # type: ignore
+    finally:
+        DECODERS.pop(RawRow)
@@ -0,0 +1,32 @@
+from conftest import MemoryProgress, MemorySource
+from meilisync.meili import Meili
+from meilisync.settings import Sync
+from meilisync.snapshot import Snapshot
+
+
+async def test_resume_snapshot():
+    sync = Sync(table="test")
+    source = MemorySource([{"id": i} for i in range(1, 11)], [(None, 5), (5, None)])
+    progress = MemoryProgress()
+    meili = Meili("http://localhost:7700", "masterKey")
+
+    snapshot = Snapshot("test", sync, source, progress, meili)
+    await snapshot.create({"pos": 1})
+    data = snapshot.get_full_data(2)
+    items = await data[0].__anext__()
+    snapshot.on_data(0, items, None)
+    await snapshot.tracker.join()
+    assert progress.snapshots["test"]["ranges"][0]["last"] == 2
+
+    snapshot = Snapshot("test", sync, source, progress, meili)
+    assert await snapshot.load()
+    ids = []
+    for i, items_iter in enumerate(snapshot.get_full_data(2)):
+        async for items in items_iter:
+            ids.extend(item["id"] for item in items)
+            snapshot.on_data(i, items, None)
+    assert ids == [3, 4, 5, 6, 7, 8, 9, 10]
+    await snapshot.tracker.join()
+    assert all(r["done"] for r in progress.snapshots["test"]["ranges"])
+    await snapshot.finish()
+    assert "test" not in progress.snapshots
@@ -0,0 +1,31 @@
+import pytest
+
+from meilisync.enums import EventType
+from meilisync.schemas import Event
+from meilisync.spool import Spool
+
+
+async def test_spool(tmp_path):
+    async def source():
+        for i in range(1000):
+            yield Event(type=EventType.create, table="test", data={"id": i}, progress={"pos": i})
+        raise ValueError
+
+    spool = Spool(str(tmp_path / "spool"), segment_size=1000, max_size=5000)
+    spool.start(source())
+    events = []
+    with pytest.raises(RuntimeError):
+        async for event in spool:
+            events.append(event)
+    assert [event.data["id"] for event in events] == list(range(1000))
+    assert len(list((tmp_path / "spool").glob("*.spool"))) == 1
+
+
+async def test_spool_keeps_other_files(tmp_path):
+    (tmp_path / "config.yml").write_text("debug: true")
+    (tmp_path / "0000000000.spool").write_bytes(b"stale")
+    (tmp_path / "read.json").write_text("{}")
+    Spool(str(tmp_path))
+    assert (tmp_path / "config.yml").read_text() == "debug: true"
+    assert (tmp_path / "0000000000.spool").read_bytes() == b""
+    assert not (tmp_path / "read.json").exists()